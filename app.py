@@ -1,12 +1,35 @@
+import os
+import re
+import json
+import time
+import zlib
+import hashlib
+import threading
+from collections import Counter
+import numpy as np
 import pandas as pd
 from datetime import date, datetime, timedelta
+import flask
 import dash_table
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import dash.dependencies
+import dash.exceptions
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.utils
+from sources import read_sources, date_columns
+from snapshot import snapshot_lock, read_snapshot, write_snapshot, mark_checked, checked_age, SNAPSHOT_MAX_AGE
+from figure_cache import cached_figure
+from responses import encode_payload, send_payload, cached_payload
+from metrics import timed, timed_stage, timed_callback, register_gauge, render, render_profile, start_profiler
+
+try:
+    import pyarrow
+except ImportError:
+    # Without pyarrow, the time series API only answers in JSON
+    pyarrow = None
 
 # Url where data will be found
 Confirmed_url = r'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data' \
@@ -17,130 +40,407 @@ Recovered_url = r'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/mast
                 r'/csse_covid_19_time_series/time_series_covid19_recovered_global.csv '
 total_url = r'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/web-data/data/cases_country.csv'
 continent_url = r'https://raw.githubusercontent.com/dbouquin/IS_608/master/NanosatDB_munging/Countries-Continents.csv'
+# Time series of every US county (there are no recovered cases per county)
+Confirmed_US_url = r'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data' \
+                   r'/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv'
+Deaths_US_url = r'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data' \
+                r'/csse_covid_19_time_series/time_series_covid19_deaths_US.csv'
+# Set COUNTY_LEVEL=1 to also read the US county .csv files, for drilling down to counties
+COUNTY_LEVEL = os.environ.get('COUNTY_LEVEL', '0') == '1'
+county_urls = [Confirmed_US_url, Deaths_US_url] if COUNTY_LEVEL else []
+
+data_urls = [Confirmed_url, Deaths_url, Recovered_url, total_url, continent_url] + county_urls
+# Time series .csv files, in the order of data_urls
+TIME_SERIES = ['Confirmed', 'Deaths', 'Recovered']
+# Metrics of the cube (location x date x metric), totals & new cases per day of every time series
+METRICS = ['Total Confirmed', 'New Confirmed', 'Total Deaths', 'New Deaths', 'Total Recovered', 'New Recovered']
+# Levels of the index of the regions below the locations, '' where a region has no province or county
+REGION_LEVELS = ['Location', 'Province', 'County']
+# Metrics in the rows of cube_frame
+FRAME_METRICS = METRICS[:4]
+# Metrics computed from the cube for every location & date, see derive_metrics
+DERIVED_METRICS = ['7-day Average Confirmed', '7-day Average Deaths', 'Weekly Growth Confirmed', 'Weekly Growth Deaths',
+                   'Doubling Time Confirmed', 'Doubling Time Deaths', 'Confirmed per 100k', 'Deaths per 100k']
+# Days in the windows of the derived metrics
+WINDOW = 7
+# Metrics of the country chart: label & column (for Confirmed or Deaths)
+BAR_METRICS = {'New': ('New per day', 'New {}'),
+               'Average': ('7-day average', '7-day Average {}'),
+               'Growth': ('Week-over-week growth (%)', 'Weekly Growth {}'),
+               'Doubling': ('Doubling time (days)', 'Doubling Time {}'),
+               'Per100k': ('Total per 100k people', '{} per 100k')}
+# Seconds between refreshes of the data, 0 to never refresh
+REFRESH_INTERVAL = int(os.environ.get('REFRESH_INTERVAL', '3600'))
+# Seconds between attempts to load the data at startup, while there is no snapshot to show
+LOAD_RETRY_INTERVAL = int(os.environ.get('LOAD_RETRY_INTERVAL', '30'))
+# Routes that answer before the data is loaded
+PROBE_PATHS = ['/healthz', '/readyz', '/metrics', '/metrics/profile']
+# 'lazy' sends one date of the map at a time, chosen with a slider, 'animated' sends all dates at once
+MAP_MODE = os.environ.get('MAP_MODE', 'lazy')
+# Days between the dates shown on the map, eg. 7 for weekly frames
+MAP_FRAME_STEP = int(os.environ.get('MAP_FRAME_STEP', '1'))
+if MAP_FRAME_STEP < 1:
+    raise ValueError('MAP_FRAME_STEP must be at least 1, not {}'.format(MAP_FRAME_STEP))
+# Rows of the Cases Worldwide table sent per page
+TABLE_PAGE_SIZE = 20
+# Operators of the table filter, as typed (eg. '>=' or 'ge'), see split_filter_part
+FILTER_OPERATORS = {'ge': 'ge', '>=': 'ge', 'le': 'le', '<=': 'le', 'lt': 'lt', '<': 'lt', 'gt': 'gt', '>': 'gt',
+                    'ne': 'ne', '!=': 'ne', 'eq': 'eq', '=': 'eq', 'contains': 'contains'}
+# One part of a table filter: {column}, the operator right after it & the value
+FILTER_PART = re.compile(r'^\s*\{(.+?)\}\s+(\S+)\s+(.*)$')
+# Country shown when the page is loaded
+DEFAULT_COUNTRY = 'United Kingdom'
+# Number of most viewed countries whose figures are built right after every refresh
+PREWARM_COUNTRIES = int(os.environ.get('PREWARM_COUNTRIES', '10'))
+# Seconds clients of the time series API may use a response before asking whether it has changed
+API_MAX_AGE = int(os.environ.get('API_MAX_AGE', '300'))
+# Most locations in one request to the time series API
+API_MAX_LOCATIONS = 1000
+API_MIMETYPES = {'json': 'application/json', 'arrow': 'application/vnd.apache.arrow.stream'}
+
+# Colours of the map, from the fewest to the most confirmed cases
+MAP_COLOR_SCALE = [(0.0, "#ffe6e6"), (0.001, "#ffe6e6"),
+                   (0.002, "#ffcccc"), (0.003, "#ffcccc"),
+                   (0.004, "#ffb3b3"), (0.005, "#ffb3b3"),
+                   (0.006, " #ff9999"), (0.007, " #ff9999"),
+                   (0.008, "#ffb399"), (0.009, "#ffb399"),
+                   (0.01, "#ffcc99"), (0.02, "#ffcc99"),
+                   (0.03, "#ffe699"), (0.04, "#ffe699"),
+                   (0.05, "#ffff99"), (0.06, "#ffff99"),
+                   (0.07, "#e6ff99"), (0.08, "#e6ff99"),
+                   (0.09, "#ccff99"), (0.1, "#ccff99"),
+                   (0.11, "#b3ff99"), (0.12, "#b3ff99"),
+                   (0.13, "#99ff99"), (0.14, "#99ff99"),
+                   (0.15, "#99ffb3"), (0.16, "#99ffb3"),
+                   (0.17, "#99ffcc"), (0.18, "#99ffcc"),
+                   (0.19, "#99ffe6"), (0.2, "#99ffe6"),
+                   (0.21, "#99ffff"), (0.22, "#99ffff"),
+                   (0.23, "#99e6ff"), (0.24, "#99e6ff"),
+                   (0.25, "#99ccff"), (0.26, "#99ccff"),
+                   (0.27, "#99b3ff"), (0.28, "#99b3ff"),
+                   (0.29, "#9999ff"), (0.30, "#9999ff"),
+                   (0.31, "#b399ff"), (0.32, "#b399ff"),
+                   (0.33, "#cc99ff"), (0.34, "#cc99ff"),
+                   (0.35, "#e699ff"), (0.36, "#e699ff"),
+                   (0.37, "#ff99ff"), (0.38, "#ff99ff"),
+                   (0.39, "#ff99e6"), (0.40, "#ff99e6"),
+                   (0.41, "#ff99cc"), (0.42, "#ff99cc"),
+                   (0.43, "#ff99b3"), (0.44, "#ff99b3"),
+                   (0.45, "#ff809f"), (0.46, "#ff809f"),
+                   (0.47, "#ff668c"), (0.48, "#ff668c"),
+                   (0.49, "#ff4d79"), (0.50, "#ff4d79"),
+                   (0.51, "#ff3366"), (0.52, "#ff3366"),
+                   (0.53, "#ff1a53"), (0.54, "#ff1a53"),
+                   (0.55, "#ff0040"), (0.56, "#ff0040"),
+                   (0.57, "#e60039"), (0.58, "#e60039"),
+                   (0.59, "#cc0033"), (0.60, "#cc0033"),
+                   (0.61, "#b3002d"), (0.62, "#b3002d"),
+                   (0.63, "#990026"), (0.64, "#990026"),
+                   (0.65, "#800020"), (0.66, "#800020"),
+                   (0.67, "#66001a"), (0.68, "#66001a"),
+                   (0.69, "#570f0f"), (0.70, "#570f0f"),
+                   (0.71, "#521414"), (0.72, "#521414"),
+                   (0.73, "#4d1919"), (0.74, "#4d1919"),
+                   (0.75, "#471f1f"), (0.76, "#471f1f"),
+                   (0.77, "#422424"), (0.78, "#422424"),
+                   (0.79, "#3d2929"), (0.80, "#3d2929"),
+                   (0.81, "#382e2e"), (0.82, "#382e2e"),
+                   (0.83, "#382e2e"), (0.84, "#382e2e"),
+                   (0.85, "#363030"), (0.86, "#363030"),
+                   (0.87, "#333333"), (1, "#333333")]
 
 # Initialise the dash app
 app = dash.Dash(__name__)
+# Shown until the data is loaded (pages answer 503 until then, see wait_for_data), replaced by publish
+app.layout = html.Div(id='loading')
 # Initialise Heroku
 server = app.server
 
+# The most recent version of the data, see publish
+dataset = None
+publish_lock = threading.Lock()
+# Set once the .csv files were checked at startup, see prepare_data
+data_checked = threading.Event()
+# Number of times every country was chosen in this worker
+country_views = Counter()
+# Precomputed map of the most recent version of the data, see prepare_map
+map_frames = None
+# Serialized & compressed page layout of the most recent version of the data
+layout_payload = None
 
-def prepare_data(Confirmed_url, Deaths_url, Recovered_url, total_url, continent_url):
-    global last_updated_df
-    global confirmed_deaths_df
-    global total_last_updated_df
-    global shown_countries
-    global total_df
-    global last_updated
-    global sum_data_daily_df
 
-    # Read .csv from github
-    Confirmed_df = pd.read_csv(Confirmed_url, index_col=False)
-    Deaths_df = pd.read_csv(Deaths_url, index_col=False)
-    Recovered_df = pd.read_csv(Recovered_url, index_col=False)
-    total_df = pd.read_csv(total_url, index_col=False)
-    continent_df = pd.read_csv(continent_url, index_col=False)
+def series_values(df):
+    """
+    This function splits a time series .csv into the Location, Province & County of every row ('' where missing)
+    and the counts of every row & date, as one int32 array. The dates of the header are parsed once
+    :return tuple: pd.DataFrame of the places, np.ndarray of rows x dates, list of dates
+    """
+    df = df.rename(columns={'Country/Region': 'Location', 'Province/State': 'Province', 'Country_Region': 'Location',
+                            'Province_State': 'Province', 'Admin2': 'County'})
+    columns = date_columns(df.columns)
+    places = pd.DataFrame({level: df[level].astype(object).fillna('') if level in df.columns else ''
+                           for level in REGION_LEVELS}, index=df.index)
+    counts = df[columns].to_numpy()
+    if counts.dtype.kind == 'f':
+        counts = np.nan_to_num(counts)
+    return places, counts.astype(np.int32, copy=False), [datetime.strptime(column, '%m/%d/%y').date()
+                                                         for column in columns]
+
+
+def group_rows(places):
+    """
+    This function finds the rows of places (a df of names) that are the same place
+    :return tuple: np.ndarray with the group of every row & pd.MultiIndex of the groups, sorted
+    """
+    groups = pd.MultiIndex.from_frame(places.drop_duplicates().sort_values(list(places.columns)))
+    return groups.get_indexer(pd.MultiIndex.from_frame(places)), groups
+
+
+def group_sums(codes, counts):
+    """
+    This function sums the counts of the rows of every group, in one pass over the sorted rows
+    :param codes: group of every row, every group from 0 to the number of groups - 1 has rows
+    :return np.ndarray: int64, groups x dates
+    """
+    if not len(codes):
+        return np.zeros((0, counts.shape[1]), dtype=np.int64)
+    order = np.argsort(codes, kind='stable')
+    starts = np.flatnonzero(np.diff(codes[order], prepend=-1))
+    return np.add.reduceat(counts[order], starts, axis=0, dtype=np.int64)
+
+
+@timed_stage
+def time_series_totals(df, county_df=None):
+    """
+    This function creates the totals of every location (country) and of every region below it
+    (province/state and, from county_df, county) for every date (columns) from a time series .csv.
+    Every level is summed up from the rows below it in one pass, provinces given by df are kept
+    and the other provinces of county_df are the sums of their counties
+    :return tuple: pd.DataFrame of the locations & pd.DataFrame of the regions, indexed by Location, Province & County
+    """
+    places, counts, dates = series_values(df)
+    # Sum up as there were a few countries with more than one rows per day (eg.UK for mainland & UK for Isle of Man)
+    codes, locations = group_rows(places[['Location']])
+    totals = pd.DataFrame(group_sums(codes, counts), index=locations.get_level_values('Location'), columns=dates)
+
+    shown = (places['Province'] != '').to_numpy()
+    region_places, region_counts = [places[shown]], [counts[shown]]
+    if county_df is not None:
+        county_places, county_counts, county_dates = series_values(county_df)
+        if county_dates != dates:
+            county_counts = pd.DataFrame(county_counts, columns=county_dates).reindex(
+                columns=dates, fill_value=0).to_numpy(dtype=np.int32)
+        # Rows without a county (eg. territories) only count towards their province
+        codes, provinces = group_rows(county_places[['Location', 'Province']])
+        new = ~provinces.isin(pd.MultiIndex.from_frame(places.loc[shown, ['Location', 'Province']]))
+        province_places = provinces.to_frame(index=False).assign(County='')
+        has_county = (county_places['County'] != '').to_numpy()
+        region_places += [province_places[new], county_places[has_county]]
+        region_counts += [group_sums(codes, county_counts)[new], county_counts[has_county]]
+
+    # Sum up regions that are in more than one row, like the locations
+    codes, regions = group_rows(pd.concat(region_places, ignore_index=True))
+    return totals, pd.DataFrame(group_sums(codes, np.concatenate(region_counts)), index=regions, columns=dates)
+
+
+def align_totals(totals):
+    """
+    This function gives the totals of every time series the locations (rows) & dates (columns) of the confirmed
+    cases, as the .csv files do not always have the same ones (eg. the recovered cases may lag by a day).
+    Missing locations & dates have 0 cases
+    :return dict:
+    """
+    first = totals[TIME_SERIES[0]]
+    return {name: totals[name].reindex(index=first.index, columns=first.columns, fill_value=0)
+            for name in TIME_SERIES}
+
+
+def align_regions(regions):
+    """
+    This function gives the regions of every time series the same rows, as some regions are only in some
+    of the .csv files (eg. there are no recovered cases per county), and the dates of the confirmed cases.
+    Missing regions & dates have 0 cases
+    :return dict:
+    """
+    index = regions[TIME_SERIES[0]].index
+    for name in TIME_SERIES[1:]:
+        index = index.union(regions[name].index)
+    columns = regions[TIME_SERIES[0]].columns
+    return {name: regions[name].reindex(index=index, columns=columns, fill_value=0) for name in TIME_SERIES}
 
-    # Rename columns
-    Deaths_df.rename(columns={'Country/Region': 'Location'}, inplace=True)
-    Confirmed_df.rename(columns={'Country/Region': 'Location'}, inplace=True)
-    Recovered_df.rename(columns={'Country/Region': 'Location'}, inplace=True)
-    total_df.rename(columns={'Country_Region': 'Location', 'Long_': 'Long', 'Last_Update': 'Last Update'}, inplace=True)
 
-    # Data cleaning
+def region_attributes(index):
+    """
+    This function creates the rows of the regions & the provinces and counties of every location, for the dropdowns
+    :return tuple: dict of (Location, Province, County) -> row of the region cube, dict of location -> province ->
+    list of counties
+    """
+    region_index = {region: row for row, region in enumerate(index)}
+    region_tree = {}
+    for location, province, county in index:
+        counties = region_tree.setdefault(location, {}).setdefault(province, [])
+        if county:
+            counties.append(county)
+    return region_index, region_tree
+
+
+@timed_stage
+def build_cube(totals, previous=None):
+    """
+    This function creates the cube of every location x date x metric (see METRICS) from the totals.
+    New cases per day are the diff of the totals, with negative values (corrections of the totals) set to 0.
+    When previous (totals of the day before the first date, one column per time series) is given,
+    it is used to find the new cases of the first date, otherwise these are 0
+    :return np.ndarray: int32
+    """
+    first = totals['Confirmed']
+    cube = np.empty((first.shape[0], first.shape[1], len(METRICS)), dtype=np.int32)
+    for i, name in enumerate(TIME_SERIES):
+        values = totals[name].to_numpy()
+        before = values[:, :1] if previous is None else previous[:, i:i + 1]
+        cube[:, :, 2 * i] = values
+        cube[:, :, 2 * i + 1] = np.diff(values, axis=1, prepend=before).clip(min=0)
+    return cube
+
+
+@timed_stage
+def location_attributes(locations, continent_df, total_df):
+    """
+    This function creates a df with the continent, lat, long, ISO3 & population of every location (index).
+    The population is found from the confirmed cases & the incident rate (cases per 100k people)
+    :return pd.DataFrame:
+    """
+    locations_df = pd.DataFrame(index=pd.Index(locations, name='Location'))
+    locations_df['Continent'] = continent_df.drop_duplicates('Country').set_index('Country')['Continent']
+    attributes_df = total_df.drop_duplicates('Location').set_index('Location')
+    for column in ['Lat', 'Long', 'ISO3']:
+        locations_df[column] = attributes_df[column]
+    incident_rate = attributes_df['Incident_Rate'].where(attributes_df['Incident_Rate'] > 0)
+    locations_df['Population'] = attributes_df['Confirmed'] * 100000 / incident_rate
+    return locations_df
+
+
+@timed_stage
+def derive_metrics(cube, population, first=0):
+    """
+    This function computes the derived metrics (see DERIVED_METRICS) of every row of a cube for the dates from
+    first on, all at once. Windows only reach 2 * WINDOW - 1 days back, so new days are derived without the older ones.
+    Metrics are NaN where they are not defined (eg. the first days, no growth or unknown population)
+    :param population: of every row, NaN where it is unknown
+    :return np.ndarray: float32, rows x dates from first x DERIVED_METRICS
+    """
+    start = max(first - 2 * WINDOW + 1, 0)
+    rows, days = cube.shape[0], cube.shape[1] - start
+    # Metrics are computed as float64 one time series at a time & written straight into the float32 result
+    derived = np.full((rows, days, len(DERIVED_METRICS)), np.nan, dtype=np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name in ['Confirmed', 'Deaths']:
+            total = np.asarray(cube[:, start:, METRICS.index('Total ' + name)], dtype=np.float64)
+            # New cases of the last WINDOW days, from the running sum
+            running = np.zeros((rows, days + 1))
+            np.cumsum(cube[:, start:, METRICS.index('New ' + name)], axis=1, out=running[:, 1:])
+            week = np.full((rows, days), np.nan)
+            np.subtract(running[:, WINDOW:], running[:, :-WINDOW], out=week[:, WINDOW - 1:])
+            del running
+            derived[:, :, DERIVED_METRICS.index('7-day Average ' + name)] = week / WINDOW
+            derived[:, WINDOW:, DERIVED_METRICS.index('Weekly Growth ' + name)] = np.where(
+                week[:, :-WINDOW] > 0, 100 * (week[:, WINDOW:] / week[:, :-WINDOW] - 1), np.nan)
+            ratio = total[:, WINDOW:] / total[:, :-WINDOW]
+            derived[:, WINDOW:, DERIVED_METRICS.index('Doubling Time ' + name)] = np.where(
+                (total[:, :-WINDOW] > 0) & (ratio > 1), WINDOW * np.log(2) / np.log(ratio), np.nan)
+            derived[:, :, DERIVED_METRICS.index(name + ' per 100k')] = total * 100000 / np.asarray(population)[:, None]
+    return derived[:, first - start:]
+
+
+def shown_rows(data):
+    """
+    :return np.ndarray: rows of the cube for the locations with a continent, which are the ones shown on the map
+    """
+    return np.flatnonzero(data['locations_df']['Continent'].notna().to_numpy())
+
+
+def cube_frame(data, columns=None):
+    """
+    This function swaps the cube back into rows of Location, Date, totals & new cases per day,
+    with the attributes of every location. Rows are sorted by Date.
+    Only locations with a continent are included
+    :param columns: columns of the cube (dates) to include, all by default
+    :return pd.DataFrame:
+    """
+    rows = shown_rows(data)
+    columns = np.arange(len(data['dates'])) if columns is None else np.asarray(columns, dtype=int)
+    values = data['cube'][np.ix_(rows, columns)][:, :, :len(FRAME_METRICS)]
+
+    df = pd.DataFrame(values.transpose(1, 0, 2).reshape(-1, len(FRAME_METRICS)), columns=FRAME_METRICS)
+    df.insert(0, 'Date', np.repeat(np.array(data['dates'], dtype=object)[columns], len(rows)))
+    df.insert(0, 'Location', np.tile(data['locations_df'].index.to_numpy()[rows], len(columns)))
+    for column in ['Continent', 'Lat', 'Long', 'ISO3']:
+        df[column] = np.tile(data['locations_df'][column].to_numpy()[rows], len(columns))
+    return df
+
+
+def location_row(data, location, province=None, county=None):
+    """
+    This function finds the row of a location, or of a province/county of it
+    :return tuple: the cube & derived metrics the row is in and the row, None if the location or region is unknown
+    """
+    if not province:
+        return data['cube'], data['derived'], data['location_index'].get(location)
+    return data['region_cube'], data['region_derived'], data['region_index'].get((location, province, county or ''))
+
+
+def location_frame(data, location, province=None, county=None):
+    """
+    This function creates a df with the Date, totals, new cases per day & derived metrics of one location
+    (or a province/county of it), read from its row of the cube
+    :return pd.DataFrame:
+    """
+    cube, derived, row = location_row(data, location, province, county)
+    values = cube[row] if row is not None else np.empty((0, len(METRICS)), dtype=np.int32)
+    derived_values = derived[row] if row is not None else np.empty((0, len(DERIVED_METRICS)), dtype=np.float32)
+    df = pd.concat([pd.DataFrame(values, columns=METRICS), pd.DataFrame(derived_values, columns=DERIVED_METRICS)],
+                   axis=1)
+    df.insert(0, 'Date', data['dates'] if row is not None else [])
+    df.insert(0, 'Location', ' / '.join(name for name in [location, province, county] if name))
+    return df
+
+
+@timed_stage
+def daily_sums(data, columns):
+    """
+    This function creates a df that summarises all Cases/Deaths for every day (columns of the cube)
+    :return pd.DataFrame:
+    """
+    columns = np.asarray(columns, dtype=int)
+    sums = data['cube'][np.ix_(shown_rows(data), columns)].sum(axis=0, dtype=np.int64)
+    averages = data['derived'][np.ix_(shown_rows(data), columns)].sum(axis=0, dtype=np.float64)
+    return pd.DataFrame({'New Confirmed': sums[:, METRICS.index('New Confirmed')],
+                         'New Deaths': sums[:, METRICS.index('New Deaths')],
+                         '7-day Average Confirmed': averages[:, DERIVED_METRICS.index('7-day Average Confirmed')],
+                         '7-day Average Deaths': averages[:, DERIVED_METRICS.index('7-day Average Deaths')],
+                         'Date': [data['dates'][column] for column in columns]})
+
+
+def clean_total(total_df):
+    """
+    This function cleans the cases_country .csv
+    :return pd.DataFrame:
+    """
+    # Rename columns
+    total_df = total_df.rename(columns={'Country_Region': 'Location', 'Long_': 'Long', 'Last_Update': 'Last Update'})
     # Drop columns
-    Deaths_df.drop(['Province/State', 'Lat', 'Long'], axis=1, inplace=True)
-    Confirmed_df.drop(['Province/State', 'Lat', 'Long'], axis=1, inplace=True)
-    Recovered_df.drop(['Province/State', 'Lat', 'Long'], axis=1, inplace=True)
-    total_df.drop(['People_Tested', 'People_Hospitalized'], axis=1, inplace=True)
-
-    # Swap rows & columns
-    Confirmed_df = Confirmed_df.melt(id_vars=["Location"],
-                                     var_name="Date",
-                                     value_name="Total Confirmed")
-    Deaths_df = Deaths_df.melt(id_vars=["Location"],
-                               var_name="Date",
-                               value_name="Total Deaths")
-    Recovered_df = Recovered_df.melt(id_vars=["Location"],
-                                     var_name="Date",
-                                     value_name="Total Recovered")
-    # Change data type to integer and date
-    Confirmed_df['Total Confirmed'] = Confirmed_df['Total Confirmed'].astype(int)
-    Deaths_df['Total Deaths'] = Deaths_df['Total Deaths'].astype(int)
-    Recovered_df['Total Recovered'] = Recovered_df['Total Recovered'].astype(int)
-    Confirmed_df['Date'] = Confirmed_df['Date'].apply(lambda x: datetime.strptime(x, '%m/%d/%y').date())
-    Deaths_df['Date'] = Deaths_df['Date'].apply(lambda x: datetime.strptime(x, '%m/%d/%y').date())
-    Recovered_df['Date'] = Recovered_df['Date'].apply(lambda x: datetime.strptime(x, '%m/%d/%y').date())
+    total_df = total_df.drop(['People_Tested', 'People_Hospitalized'], axis=1)
+    # Change data type to date
     total_df['Last Update'] = total_df['Last Update'][0]
     total_df['Last Update'] = total_df['Last Update'].apply(lambda x: datetime.strptime(x, '%Y-%m-%d %H:%M:%S').date())
+    return total_df
 
-    # Group by as there were a few countries with more than one rows per day (eg.UK for mainland & UK for Isle of Man)
-    Confirmed_df = Confirmed_df.groupby(['Location', 'Date'])['Total Confirmed'].sum().to_frame()
-    Confirmed_df = Confirmed_df.assign(**Confirmed_df.index.to_frame()).reset_index(drop=True)
-    Deaths_df = Deaths_df.groupby(['Location', 'Date'])['Total Deaths'].sum().to_frame()
-    Deaths_df = Deaths_df.assign(**Deaths_df.index.to_frame()).reset_index(drop=True)
-    Recovered_df = Recovered_df.groupby(['Location', 'Date'])['Total Recovered'].sum().to_frame()
-    Recovered_df = Recovered_df.assign(**Recovered_df.index.to_frame()).reset_index(drop=True)
-
-    # Change column order
-    Confirmed_df = Confirmed_df[['Location', 'Date', 'Total Confirmed']]
-    Deaths_df = Deaths_df[['Location', 'Date', 'Total Deaths']]
-    Recovered_df = Recovered_df[['Location', 'Date', 'Total Recovered']]
-
-    # Find all unique countries in the dataframe and add to list
-    shown_countries = []
-    shown_countries = Confirmed_df['Location'].unique().tolist()
-
-    # Create an empty df
-    new_Confirmed_df = pd.DataFrame(columns=['Location', 'Date', 'Total Confirmed', 'New Confirmed'])
-    new_Deaths_df = pd.DataFrame(columns=['Location', 'Date', 'Total Deaths', 'New Deaths'])
-    new_Recovered_df = pd.DataFrame(columns=['Location', 'Date', 'Total Recovered', 'New Recovered'])
-
-    # Create a country_df with data for each country, diff to fine New cases per day, append to new_Confirmed_df
-    for country in shown_countries:
-        confirmed_country_df = Confirmed_df.loc[Confirmed_df['Location'] == country]
-        confirmed_country_df = confirmed_country_df.sort_values('Date')
-        confirmed_country_df['New Confirmed'] = confirmed_country_df['Total Confirmed'].diff().fillna(0).astype(int)
-        new_Confirmed_df = new_Confirmed_df.append(confirmed_country_df)
-
-        Deaths_country_df = Deaths_df.loc[Deaths_df['Location'] == country]
-        Deaths_country_df = Deaths_country_df.sort_values('Date')
-        Deaths_country_df['New Deaths'] = Deaths_country_df['Total Deaths'].diff().fillna(0).astype(int)
-        new_Deaths_df = new_Deaths_df.append(Deaths_country_df)
-
-        Recovered_country_df = Recovered_df.loc[Recovered_df['Location'] == country]
-        Recovered_country_df = Recovered_country_df.sort_values('Date')
-        Recovered_country_df['New Recovered'] = Recovered_country_df['Total Recovered'].diff().fillna(0).astype(int)
-        new_Recovered_df = new_Recovered_df.append(Recovered_country_df)
-
-    for i in range(len(new_Confirmed_df) - 1):
-        if new_Confirmed_df.iloc[i + 1, 3] < 0:
-            new_Confirmed_df.iloc[i + 1, 3] = 0
-
-    for i in range(len(new_Deaths_df) - 1):
-        if new_Deaths_df.iloc[i + 1, 3] < 0:
-            new_Deaths_df.iloc[i + 1, 3] = 0
-
-    for i in range(len(new_Recovered_df) - 1):
-        if new_Recovered_df.iloc[i + 1, 3] < 0:
-            new_Recovered_df.iloc[i + 1, 3] = 0
-
-    # Merge confirmed and deaths dfs
-    confirmed_deaths_df = new_Confirmed_df.merge(new_Deaths_df, left_on=['Location', 'Date'],
-                                                 right_on=['Location', 'Date'])
-    # Merge df with continent df
-    confirmed_deaths_df = confirmed_deaths_df.merge(continent_df, left_on='Location', right_on='Country')
-    confirmed_deaths_df = confirmed_deaths_df.drop('Country', axis=1)
-
-    # Create a df with only lat, long of each location
-    lat_df = total_df[['Location', 'Lat', 'Long']].copy()
-    # Create a df with only lat, long of each location
-    iso_df = total_df[['Location', 'ISO3']].copy()
-
-    # Merge confirmed_deaths_df with the lat, long of total_df
-    confirmed_deaths_df = confirmed_deaths_df.merge(lat_df, left_on='Location', right_on='Location', how='left')
-    # Merge confirmed_deaths_df with the lat, long of total_df
-    confirmed_deaths_df = confirmed_deaths_df.merge(iso_df, left_on='Location', right_on='Location', how='left')
 
+@timed_stage
+def add_totals(data, total_df, continent_df):
+    """
+    This function adds the dfs that depend on the most recent totals (cases_country .csv) to data
+    """
     # Merge total_df with continent_df
     total_df = total_df.merge(continent_df, left_on='Location', right_on='Country', how='left')
     total_df = total_df.drop('Country', axis=1)
@@ -155,34 +455,558 @@ def prepare_data(Confirmed_url, Deaths_url, Recovered_url, total_url, continent_
 
     # Find last date when data was updated
     last_updated = total_last_updated_df['Last Update'][0]
-    if last_updated not in confirmed_deaths_df:
+    if last_updated not in data['date_index']:
         last_updated = total_last_updated_df['Last Update'][0] - timedelta(days=1)
 
+    data['total_df'] = total_df
+    data['total_last_updated_df'] = total_last_updated_df
+    data['last_updated'] = last_updated
+    # Create a df for the Cases Worldwide table, with the order of its rows by every column
+    table_df = total_last_updated_df.drop(['Last Update', 'Continent'], axis=1).reset_index(drop=True)
+    data['table_df'] = table_df
+    data['table_order'] = {column: np.argsort(table_df[column].to_numpy(), kind='mergesort')
+                           for column in table_df.columns}
     # Create a df with the new cases of most recent data
-    last_updated_df = confirmed_deaths_df[confirmed_deaths_df['Date'] == last_updated]
+    if last_updated in data['date_index']:
+        data['last_updated_df'] = cube_frame(data, [data['date_index'][last_updated]])
+    else:
+        data['last_updated_df'] = cube_frame(data, [])
+    # Versions are the same in every worker for the same data, and change with any of it (eg. a location added
+    # without a new date or update time)
+    data['version'] = '{:%Y%m%d}-{}-{}'.format(data['dates'][-1], ''.join(filter(str.isdigit, data['total_updated'])),
+                                               content_hash(data))
+    data['created'] = time.time()
 
-    # Create a df that summarises all Cases/Deaths for every day
-    sum_data_daily_df = confirmed_deaths_df.groupby(['Date']).agg({'New Confirmed': 'sum', 'New Deaths': 'sum'})
-    sum_data_daily_df = sum_data_daily_df.assign(**sum_data_daily_df.index.to_frame()).reset_index(drop=True)
 
+def content_hash(data):
+    """
+    This function hashes the contents of the data: locations & regions, cubes, totals and continents
+    :return str:
+    """
+    digest = hashlib.sha1(repr(data['series_rows']).encode())
+    for key in ['cube', 'region_cube']:
+        digest.update(np.ascontiguousarray(data[key]).data)
+    for key in ['total_df', 'continent_df']:
+        digest.update(pd.util.hash_pandas_object(data[key]).to_numpy().data)
+    return digest.hexdigest()[:10]
 
-def visualise_dash():
+
+def series_rows(levels):
+    """
+    This function lists the locations & regions of every time series as they are in the .csv files, before they
+    are aligned, so that update_data finds out when any of them changes
+    :return dict:
+    """
+    return {name: (levels[name][0].index.tolist(), levels[name][1].index.tolist()) for name in TIME_SERIES}
+
+
+@timed_stage
+def build_data(Confirmed_df, Deaths_df, Recovered_df, total_df, continent_df, Confirmed_US_df=None,
+               Deaths_US_df=None):
+    """
+    This function prepares all the data shown on the dashboard from the .csv files
+    :return dict:
+    """
+    levels = {'Confirmed': time_series_totals(Confirmed_df, Confirmed_US_df),
+              'Deaths': time_series_totals(Deaths_df, Deaths_US_df),
+              'Recovered': time_series_totals(Recovered_df)}
+    totals = align_totals({name: levels[name][0] for name in TIME_SERIES})
+    regions = align_regions({name: levels[name][1] for name in TIME_SERIES})
+    dates = totals['Confirmed'].columns.tolist()
+    # Find all unique countries in the dataframe and add to list
+    shown_countries = totals['Confirmed'].index.tolist()
+
+    total_updated = total_df['Last_Update'][0]
+    total_df = clean_total(total_df)
+
+    data = {'cube': build_cube(totals),
+            'dates': dates,
+            'date_index': {day: column for column, day in enumerate(dates)},
+            'shown_countries': shown_countries,
+            'location_index': {location: row for row, location in enumerate(shown_countries)},
+            'locations_df': location_attributes(shown_countries, continent_df, total_df),
+            'region_cube': build_cube(regions),
+            'regions': regions['Confirmed'].index.tolist(),
+            'continent_df': continent_df,
+            'series_rows': series_rows(levels),
+            'total_updated': total_updated}
+    data['region_index'], data['region_tree'] = region_attributes(data['regions'])
+    # The population of provinces & counties is not known, they have no metrics per 100k people
+    data['derived'] = derive_metrics(data['cube'], data['locations_df']['Population'].to_numpy())
+    data['region_derived'] = derive_metrics(data['region_cube'], np.full(len(data['regions']), np.nan))
+    data['sum_data_daily_df'] = daily_sums(data, range(len(dates)))
+    add_totals(data, total_df, continent_df)
+    return data
+
+
+@timed_stage
+def update_data(data, Confirmed_df, Deaths_df, Recovered_df, total_df, continent_df, Confirmed_US_df=None,
+                Deaths_US_df=None):
+    """
+    This function adds the days that are new in the .csv files to a copy of data.
+    Only the new days are diffed & summed, days that were already in data are not recomputed.
+    If locations or regions were added or removed (in any of the time series), all data is prepared again
+    :return dict: None when nothing has changed
+    """
+    levels = {'Confirmed': time_series_totals(Confirmed_df, Confirmed_US_df),
+              'Deaths': time_series_totals(Deaths_df, Deaths_US_df),
+              'Recovered': time_series_totals(Recovered_df)}
+    totals = {name: levels[name][0] for name in TIME_SERIES}
+    regions = align_regions({name: levels[name][1] for name in TIME_SERIES})
+    new_dates = [day for day in totals['Confirmed'].columns if day not in data['date_index']]
+    total_updated = total_df['Last_Update'][0]
+
+    if series_rows(levels) != data['series_rows'] or \
+            not continent_df.equals(data['continent_df']) or \
+            any(totals[name].columns.tolist() != data['dates'] + new_dates for name in TIME_SERIES):
+        return build_data(Confirmed_df, Deaths_df, Recovered_df, total_df, continent_df, Confirmed_US_df,
+                          Deaths_US_df)
+    totals = align_totals(totals)
+    if not new_dates and total_updated == data['total_updated']:
+        return None
+
+    data = dict(data, total_updated=total_updated)
+    total_df = clean_total(total_df)
+    if new_dates:
+        # Totals of the last known day are needed to find the new cases of the first new day
+        previous = data['cube'][:, -1, 0::2]
+        new_cube = build_cube({name: totals[name][new_dates] for name in TIME_SERIES}, previous)
+
+        data['cube'] = np.concatenate([data['cube'], new_cube], axis=1)
+        new_region_cube = build_cube({name: regions[name][new_dates] for name in TIME_SERIES},
+                                     data['region_cube'][:, -1, 0::2])
+        data['region_cube'] = np.concatenate([data['region_cube'], new_region_cube], axis=1)
+        # Only the new days are derived, from the days before them
+        first = len(data['dates'])
+        new_derived = derive_metrics(data['cube'], data['locations_df']['Population'].to_numpy(), first)
+        data['derived'] = np.concatenate([data['derived'], new_derived], axis=1)
+        new_region_derived = derive_metrics(data['region_cube'], np.full(len(data['regions']), np.nan), first)
+        data['region_derived'] = np.concatenate([data['region_derived'], new_region_derived], axis=1)
+        data['dates'] = data['dates'] + new_dates
+        data['date_index'] = {day: column for column, day in enumerate(data['dates'])}
+        new_columns = range(len(data['dates']) - len(new_dates), len(data['dates']))
+        data['sum_data_daily_df'] = pd.concat([data['sum_data_daily_df'], daily_sums(data, new_columns)],
+                                              ignore_index=True)
+    add_totals(data, total_df, continent_df)
+    return data
+
+
+@timed_stage
+def publish(data):
+    """
+    This function swaps in a new version of the data. Callbacks read the dataset dict once,
+    so they see either the old or the new version, never a mix of the two
+    """
+    global dataset
+    global map_frames
+    global layout_payload
+    global last_updated_df
+    global total_last_updated_df
+    global shown_countries
+    global total_df
+    global last_updated
+    global sum_data_daily_df
+
+    new_map_frames = prepare_map(data) if MAP_MODE == 'lazy' else None
+    layout = build_layout(data)
+    new_layout_payload = encode_payload(json.dumps(layout, cls=plotly.utils.PlotlyJSONEncoder).encode(),
+                                        'application/json')
+    with publish_lock:
+        dataset = data
+        map_frames = new_map_frames
+        layout_payload = new_layout_payload
+        last_updated_df = data['last_updated_df']
+        total_last_updated_df = data['total_last_updated_df']
+        shown_countries = data['shown_countries']
+        total_df = data['total_df']
+        last_updated = data['last_updated']
+        sum_data_daily_df = data['sum_data_daily_df']
+        app.layout = layout
+
+
+@server.before_request
+def wait_for_data():
+    """
+    Until a first version of the data is shown, pages & callbacks answer 503 Service Unavailable
+    """
+    if dataset is None and flask.request.path not in PROBE_PATHS:
+        response = flask.Response('The data is loading, please retry shortly\n', status=503, mimetype='text/plain')
+        response.headers['Retry-After'] = str(LOAD_RETRY_INTERVAL)
+        return response
+
+
+def data_status():
+    """
+    This function describes the data shown, for the probes
+    :return dict:
+    """
+    data = dataset
+    status = {'version': None, 'last_updated': None, 'age_seconds': None, 'checking': not data_checked.is_set()}
+    if data is not None:
+        status.update(version=data['version'], last_updated=str(data['last_updated']),
+                      age_seconds=round(time.time() - data['created'], 3))
+    return status
+
+
+@server.route('/healthz')
+def serve_health():
+    """
+    Liveness: the worker answers, even while it loads the data
+    """
+    return flask.jsonify(dict(data_status(), status='alive'))
+
+
+@server.route('/readyz')
+def serve_ready():
+    """
+    Readiness: the worker shows some version of the data (maybe an old snapshot, while a new one is loaded)
+    """
+    status = data_status()
+    if status['version'] is None:
+        return flask.jsonify(dict(status, status='loading')), 503
+    return flask.jsonify(dict(status, status='ready'))
+
+
+@server.before_request
+def serve_layout():
+    """
+    The layout only changes with the data, so it is serialized & compressed once per version (see publish)
+    instead of by Dash on every page load
+    """
+    if flask.request.path == app.config.routes_pathname_prefix + '_dash-layout' and layout_payload is not None:
+        return send_payload(layout_payload)
+
+
+@server.route('/metrics')
+def serve_metrics():
+    return flask.Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+@server.route('/metrics/profile')
+def serve_profile():
+    """
+    Collapsed stacks sampled by the profiler, empty unless PROFILE_INTERVAL is set
+    """
+    return flask.Response(render_profile(), mimetype='text/plain')
+
+
+def json_values(values):
+    """
+    This function converts an array to lists for JSON, with NaN as null. Derived metrics (float32) are rounded
+    to 2 decimals
+    :return list:
+    """
+    if values.dtype.kind != 'f':
+        return values.tolist()
+    converted = values.astype(np.float64)
+    if values.dtype == np.float32:
+        converted = np.round(converted, 2)
+    converted = converted.astype(object)
+    converted[np.isnan(values)] = None
+    return converted.tolist()
+
+
+def arrow_body(columns, version):
+    """
+    This function writes columns (name -> array) as an Arrow IPC stream, with the version of the data in its metadata
+    :return bytes:
+    """
+    table = pyarrow.table(columns).replace_schema_metadata({'version': version})
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def series_payload(data, locations, start, end, metrics, output_format):
+    """
+    This function reads the time series of locations (or provinces/counties, as 'Location / Province / County')
+    between two dates (ISO dates, '' for the first/last date) straight from the cubes.
+    JSON is columnar: for every metric, a list of values per location. Arrow has a row per location & date
+    :return dict: see encode_payload
+    """
+    if not locations or len(locations) > API_MAX_LOCATIONS:
+        raise ValueError('Ask for 1 to {} locations'.format(API_MAX_LOCATIONS))
+    metrics = list(metrics) or METRICS
+    unknown = [metric for metric in metrics if metric not in METRICS + DERIVED_METRICS]
+    if unknown:
+        raise ValueError('Unknown metrics: {}'.format(', '.join(unknown)))
+    first = np.searchsorted(data['dates'], date.fromisoformat(start)) if start else 0
+    last = np.searchsorted(data['dates'], date.fromisoformat(end), side='right') if end else len(data['dates'])
+
+    rows = []
+    for location in locations:
+        names = location.split(' / ')
+        if len(names) > len(REGION_LEVELS):
+            raise ValueError('Locations are Location / Province / County: {}'.format(location))
+        cube, derived, row = location_row(data, *names)
+        if row is None:
+            raise ValueError('Unknown location: {}'.format(location))
+        rows.append((cube[row, first:last], derived[row, first:last]))
+    values = {metric: np.stack([cube_values[:, METRICS.index(metric)] if metric in METRICS else
+                                derived_values[:, DERIVED_METRICS.index(metric)]
+                                for cube_values, derived_values in rows])
+              for metric in metrics}
+    dates = data['dates'][first:last]
+
+    if output_format == 'arrow':
+        columns = {'Location': pyarrow.DictionaryArray.from_arrays(np.repeat(np.arange(len(locations)), len(dates)),
+                                                                    list(locations)),
+                   'Date': pyarrow.array(dates * len(locations), type=pyarrow.date32())}
+        columns.update((metric, metric_values.ravel()) for metric, metric_values in values.items())
+        body = arrow_body(columns, data['version'])
+    else:
+        body = json.dumps({'version': data['version'],
+                           'locations': list(locations),
+                           'dates': [day.isoformat() for day in dates],
+                           'series': {metric: json_values(metric_values) for metric, metric_values in values.items()}},
+                          separators=(',', ':')).encode()
+    return encode_payload(body, API_MIMETYPES[output_format], fast=True)
+
+
+def frame_payload(df, version, output_format):
+    """
+    This function writes a df as columns, in JSON or Arrow
+    :return dict: see encode_payload
+    """
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].map(lambda value: value.isoformat() if isinstance(value, date) else
+                                        None if pd.isna(value) else value)
+    if output_format == 'arrow':
+        body = arrow_body({column: df[column].to_numpy() for column in df.columns}, version)
+    else:
+        body = json.dumps({'version': version,
+                           'columns': {column: json_values(df[column].to_numpy()) for column in df.columns}},
+                          separators=(',', ':')).encode()
+    return encode_payload(body, API_MIMETYPES[output_format], fast=True)
+
+
+def api_response(name, query, build):
+    """
+    This function answers a request to the time series API from the payloads kept in memory for every version of
+    the data & query. ETags change with the version, as the body does
+    :return flask.Response:
+    """
+    data = dataset
+    output_format = flask.request.args.get('format', 'json')
+    if output_format not in API_MIMETYPES:
+        flask.abort(400, 'format is json or arrow')
+    if output_format == 'arrow' and pyarrow is None:
+        flask.abort(406, 'Arrow responses need pyarrow')
+    try:
+        payload = cached_payload((data['version'], name, output_format) + query,
+                                 lambda: build(data, output_format))
+    except ValueError as error:
+        flask.abort(400, str(error))
+    return send_payload(payload, max_age=API_MAX_AGE)
+
+
+@server.route('/api/v1/series')
+@timed('dashboard_api_seconds', route='series')
+def serve_series():
+    """
+    Time series of one or many locations, eg. /api/v1/series?location=Italy&location=US / New York&start=2020-03-01
+    &end=2020-04-30&metric=New Confirmed&metric=7-day Average Confirmed&format=arrow
+    """
+    args = flask.request.args
+    query = (tuple(args.getlist('location')), args.get('start', ''), args.get('end', ''),
+             tuple(args.getlist('metric')))
+    return api_response('series', query, lambda data, output_format: series_payload(data, *query, output_format))
+
+
+@server.route('/api/v1/totals')
+@timed('dashboard_api_seconds', route='totals')
+def serve_totals():
+    """
+    Most recent totals of every location, from the cases_country .csv
+    """
+    return api_response('totals', (), lambda data, output_format: frame_payload(
+        data['total_df'], data['version'], output_format))
+
+
+@server.route('/api/v1/daily')
+@timed('dashboard_api_seconds', route='daily')
+def serve_daily():
+    """
+    Global new cases & deaths of every day
+    """
+    return api_response('daily', (), lambda data, output_format: frame_payload(
+        data['sum_data_daily_df'], data['version'], output_format))
+
+
+@server.route('/api/v1/locations')
+@timed('dashboard_api_seconds', route='locations')
+def serve_locations():
+    """
+    Names of the locations & regions the time series API knows
+    """
+    def build(data, output_format):
+        regions = [' / '.join(name for name in region if name) for region in data['regions']]
+        locations_df = pd.DataFrame({'Location': data['shown_countries'] + regions})
+        return frame_payload(locations_df, data['version'], output_format)
+
+    return api_response('locations', (), build)
+
+
+def data_gauges(name):
+    """
+    This function reads a metric of the data shown when the metrics are rendered
+    :return list: (labels, value) pairs
+    """
+    data = dataset
+    if data is None:
+        return []
+    if name == 'info':
+        return [({'version': data['version'], 'last_updated': data['last_updated']}, 1)]
+    if name == 'age':
+        return [({}, round(time.time() - data['created'], 3))]
+    if name == 'days':
+        return [({}, len(data['dates']))]
+    return [({}, len(data['shown_countries']))]
+
+
+register_gauge('dashboard_data_info', lambda: data_gauges('info'))
+register_gauge('dashboard_data_age_seconds', lambda: data_gauges('age'))
+register_gauge('dashboard_data_days', lambda: data_gauges('days'))
+register_gauge('dashboard_data_locations', lambda: data_gauges('locations'))
+register_gauge('dashboard_layout_bytes', lambda: [({'encoding': encoding}, len(layout_payload[encoding][0]))
+                                                  for encoding in ['identity', 'gzip', 'br']
+                                                  if layout_payload is not None and encoding in layout_payload])
+
+
+@timed_stage
+def load_data(urls, data=None):
+    """
+    This function finds the most recent version of the data, shared by all workers through a snapshot.
+    If the .csv files were checked recently (by any worker) the current snapshot is mapped,
+    otherwise the .csv files are read, the new days are added to data (or the current snapshot)
+    and a new snapshot is written
+    :return dict:
+    """
+    with snapshot_lock():
+        if checked_age() < SNAPSHOT_MAX_AGE:
+            current = read_snapshot()
+            if current is not None:
+                return current
+
+        previous = data if data is not None else read_snapshot()
+        # Read .csv from github (or a local directory/mirror), all at the same time
+        sources = read_sources(urls)
+        if previous is None:
+            new = build_data(*sources)
+        else:
+            new = update_data(previous, *sources)
+        mark_checked()
+        if new is None:
+            return previous
+
+        write_snapshot(new)
+        return read_snapshot(new['version'])
+
+
+def prepare_data(Confirmed_url, Deaths_url, Recovered_url, total_url, continent_url):
+    """
+    This function shows the current snapshot right away, even an old one, so the worker is ready without waiting
+    for the .csv files. If they were not checked recently (or there is no snapshot) they are read in the
+    background and the new version is swapped in when it is ready
+    """
+    urls = [Confirmed_url, Deaths_url, Recovered_url, total_url, continent_url] + county_urls
+    current = read_snapshot()
+    if current is not None:
+        publish(current)
+    if current is not None and checked_age() < SNAPSHOT_MAX_AGE:
+        data_checked.set()
+    else:
+        start_loader(urls)
+
+
+def start_loader(urls, retry_interval=LOAD_RETRY_INTERVAL):
+    """
+    This function starts a background thread that checks the .csv files once. While there is no data to show
+    it tries again every retry_interval seconds, otherwise the refresher tries again later
+    """
+    def load_until_checked():
+        while True:
+            try:
+                refresh_data(urls)
+                break
+            except Exception:
+                server.logger.exception('Loading the data failed')
+                if dataset is not None:
+                    break
+                time.sleep(retry_interval)
+        data_checked.set()
+
+    threading.Thread(target=load_until_checked, name='loader', daemon=True).start()
+
+
+def refresh_data(urls=data_urls):
+    """
+    This function checks for a new version of the data and swaps it in
+    :return bool: True if the data has changed
+    """
+    data = load_data(urls, dataset)
+    if dataset is not None and data['version'] == dataset['version']:
+        return False
+    publish(data)
+    warm_figures(data)
+    return True
+
+
+@timed_stage
+def warm_figures(data):
+    """
+    This function builds the series of the most viewed countries for a new version of the data,
+    before anyone asks for them
+    """
+    countries = [DEFAULT_COUNTRY] + [country for country, views in country_views.most_common(PREWARM_COUNTRIES)
+                                     if country != DEFAULT_COUNTRY]
+    for country in countries:
+        cached_figure(data['version'], 'Series', [country, '', '', 'New'],
+                      lambda: country_series(data, country, None, None))
+
+
+def start_refresher(interval=REFRESH_INTERVAL):
+    """
+    This function starts a background thread that refreshes the data every interval seconds
+    """
+    def refresh_forever():
+        while True:
+            time.sleep(interval)
+            try:
+                refresh_data()
+            except Exception:
+                server.logger.exception('Refreshing the data failed, the previous version is still shown')
+
+    if interval > 0:
+        threading.Thread(target=refresh_forever, name='refresher', daemon=True).start()
+
+
+@timed_stage
+def build_layout(data):
+    """
+    This function creates the page layout for a version of the data
+    :return html.Div:
+    """
     def generate_table():
         """
-        This function creates an HTML.TABLE to illustrate the 10 countries
-        with the most cases for today
+        This function creates an HTML.TABLE to illustrate the countries with the most cases for today.
+        Rows are paged, sorted & filtered by update_table
         :return html.table:
         """
-        table_df = total_last_updated_df.copy().drop(['Last Update', 'Continent'],
-                                                     axis=1).sort_values('Confirmed', ascending=False)
-        table_df['Confirmed'] = table_df['Confirmed'].apply('{:,}'.format)
-        table_df['Deaths'] = table_df['Deaths'].apply('{:,}'.format)
-        table_df['Recovered'] = table_df['Recovered'].apply('{:,}'.format)
-        table_df['Active'] = table_df['Active'].apply('{:,}'.format)
-
         return dash_table.DataTable(
-            data=table_df.to_dict('records'),
-            columns=[{'id': c, 'name': c} for c in table_df.columns],
+            id='table',
+            columns=[{'id': c, 'name': c} for c in data['table_df'].columns],
+            page_action='custom',
+            page_current=0,
+            page_size=TABLE_PAGE_SIZE,
+            sort_action='custom',
+            sort_mode='single',
+            sort_by=[],
+            filter_action='custom',
+            filter_query='',
             style_cell={'padding': '1px', 'textAlign': 'left', 'border': '1px solid rgb(237, 237, 237)',
                         'font_family': 'sans-serif', 'minWidth': '100px', 'width': '100px', 'maxWidth': '100px',
                         'font_size': '16px', 'color': 'rgb(93, 103, 110)'},
@@ -192,13 +1016,17 @@ def visualise_dash():
             style_data={'textAlign': 'center', 'minWidth': '5px', 'width': '5px', 'maxWidth': '5px'})
 
     def cases_line_graph():
-        bar_df = sum_data_daily_df.copy()
+        bar_df = data['sum_data_daily_df'].copy()
         # bar_df.loc[:, 'Cases'] = bar_df.loc[:, 'Cases'].apply('{:,}'.format)
         # bar_df.loc[:, 'Deaths'] = bar_df.loc[:, 'Deaths'].apply('{:,}'.format)
 
         fig = go.Figure(data=[
             go.Scatter(name='Cases', marker_color='#3380cc', x=bar_df['Date'], y=bar_df['New Confirmed']),
-            go.Scatter(name='Deaths', marker_color='#cc0066', x=bar_df['Date'], y=bar_df['New Deaths'])])
+            go.Scatter(name='Deaths', marker_color='#cc0066', x=bar_df['Date'], y=bar_df['New Deaths']),
+            go.Scatter(name='Cases (7-day average)', line=dict(color='#3380cc', dash='dot'), x=bar_df['Date'],
+                       y=bar_df['7-day Average Confirmed'].round(1)),
+            go.Scatter(name='Deaths (7-day average)', line=dict(color='#cc0066', dash='dot'), x=bar_df['Date'],
+                       y=bar_df['7-day Average Deaths'].round(1))])
 
         fig.update_layout(height=500, template='none',
                           xaxis=dict(title='Date', showgrid=False),
@@ -206,8 +1034,8 @@ def visualise_dash():
 
         return fig
 
-    def update_map_graph():
-        map_df = confirmed_deaths_df.sort_values('Date', ascending=True).copy()
+    def animated_map_graph():
+        map_df = cube_frame(data, map_columns(data))
         # map_df.loc[:, 'Cases'] = map_df.loc[:, 'Cases'].apply('{:,}'.format)
         # map_df.loc[:, 'Deaths'] = map_df.loc[:, 'Deaths'].apply('{:,}'.format)
         # map_df['Population'].astype(str)
@@ -220,55 +1048,7 @@ def visualise_dash():
                             hover_data={'Total Confirmed':True, 'Total Deaths':True, 'Date':False, 'ISO3':False},
                             animation_frame=map_df["Date"].astype(str),
                             range_color=[10, max(map_df['Total Confirmed'])],
-                            color_continuous_scale=[(0.0, "#ffe6e6"), (0.001, "#ffe6e6"),
-                                                    (0.002, "#ffcccc"), (0.003, "#ffcccc"),
-                                                    (0.004, "#ffb3b3"), (0.005, "#ffb3b3"),
-                                                    (0.006, " #ff9999"), (0.007, " #ff9999"),
-                                                    (0.008, "#ffb399"), (0.009, "#ffb399"),
-                                                    (0.01, "#ffcc99"), (0.02, "#ffcc99"),
-                                                    (0.03, "#ffe699"), (0.04, "#ffe699"),
-                                                    (0.05, "#ffff99"), (0.06, "#ffff99"),
-                                                    (0.07, "#e6ff99"), (0.08, "#e6ff99"),
-                                                    (0.09, "#ccff99"), (0.1, "#ccff99"),
-                                                    (0.11, "#b3ff99"), (0.12, "#b3ff99"),
-                                                    (0.13, "#99ff99"), (0.14, "#99ff99"),
-                                                    (0.15, "#99ffb3"), (0.16, "#99ffb3"),
-                                                    (0.17, "#99ffcc"), (0.18, "#99ffcc"),
-                                                    (0.19, "#99ffe6"), (0.2, "#99ffe6"),
-                                                    (0.21, "#99ffff"), (0.22, "#99ffff"),
-                                                    (0.23, "#99e6ff"), (0.24, "#99e6ff"),
-                                                    (0.25, "#99ccff"), (0.26, "#99ccff"),
-                                                    (0.27, "#99b3ff"), (0.28, "#99b3ff"),
-                                                    (0.29, "#9999ff"), (0.30, "#9999ff"),
-                                                    (0.31, "#b399ff"), (0.32, "#b399ff"),
-                                                    (0.33, "#cc99ff"), (0.34, "#cc99ff"),
-                                                    (0.35, "#e699ff"), (0.36, "#e699ff"),
-                                                    (0.37, "#ff99ff"), (0.38, "#ff99ff"),
-                                                    (0.39, "#ff99e6"), (0.40, "#ff99e6"),
-                                                    (0.41, "#ff99cc"), (0.42, "#ff99cc"),
-                                                    (0.43, "#ff99b3"), (0.44, "#ff99b3"),
-                                                    (0.45, "#ff809f"), (0.46, "#ff809f"),
-                                                    (0.47, "#ff668c"), (0.48, "#ff668c"),
-                                                    (0.49, "#ff4d79"), (0.50, "#ff4d79"),
-                                                    (0.51, "#ff3366"), (0.52, "#ff3366"),
-                                                    (0.53, "#ff1a53"), (0.54, "#ff1a53"),
-                                                    (0.55, "#ff0040"), (0.56, "#ff0040"),
-                                                    (0.57, "#e60039"), (0.58, "#e60039"),
-                                                    (0.59, "#cc0033"), (0.60, "#cc0033"),
-                                                    (0.61, "#b3002d"), (0.62, "#b3002d"),
-                                                    (0.63, "#990026"), (0.64, "#990026"),
-                                                    (0.65, "#800020"), (0.66, "#800020"),
-                                                    (0.67, "#66001a"), (0.68, "#66001a"),
-                                                    (0.69, "#570f0f"), (0.70, "#570f0f"),
-                                                    (0.71, "#521414"), (0.72, "#521414"),
-                                                    (0.73, "#4d1919"), (0.74, "#4d1919"),
-                                                    (0.75, "#471f1f"), (0.76, "#471f1f"),
-                                                    (0.77, "#422424"), (0.78, "#422424"),
-                                                    (0.79, "#3d2929"), (0.80, "#3d2929"),
-                                                    (0.81, "#382e2e"), (0.82, "#382e2e"),
-                                                    (0.83, "#382e2e"), (0.84, "#382e2e"),
-                                                    (0.85, "#363030"), (0.86, "#363030"),
-                                                    (0.87, "#333333"), (1, "#333333")])
+                            color_continuous_scale=MAP_COLOR_SCALE)
         fig.update_layout(height=600,
                           title_x=0.5,
                           geo=dict(
@@ -278,8 +1058,24 @@ def visualise_dash():
 
         return fig
 
+    def map_graph():
+        if MAP_MODE != 'lazy':
+            return [dcc.Graph(figure=animated_map_graph())]
+
+        # The figure is sent by update_map_graph, one date at a time
+        columns = map_columns(data)
+        marked = columns[::max(len(columns) // 10, 1)] + columns[-1:]
+        return [dcc.Graph(id='Map'),
+                dcc.Slider(id='map-date',
+                           min=columns[0],
+                           max=columns[-1],
+                           step=MAP_FRAME_STEP,
+                           value=columns[-1],
+                           included=False,
+                           marks={column: data['dates'][column].strftime('%d %b %y') for column in marked})]
+
     # Prepare the page layout
-    app.layout = html.Div(className='overall-background',
+    return html.Div(className='overall-background',
                           children=[html.Div(className='title1',
                                              children=[
                                                  html.H1(children='Global Spread of Coronavirus',
@@ -291,46 +1087,45 @@ def visualise_dash():
                                             html.H5(children=['New Cases'],
                                                     style={'color': 'black', 'font-size': '0.7vw',
                                                            'margin-bottom': '10px'}),
-                                            html.H3(children=[f"{last_updated_df['New Confirmed'].sum():,d}"],
+                                            html.H3(children=[f"{data['last_updated_df']['New Confirmed'].sum():,d}"],
                                                     style={'color': '#e62e00', 'font-size': '1.5vw',
                                                            'margin-top': '0px'})]),
                                         html.Div(className='plate', id='TotalCases', children=[
                                             html.H5(children=['Total Cases'],
                                                     style={'color': 'black', 'font-size': '0.7vw',
                                                            'margin-bottom': '10px'}),
-                                            html.H3(children=[f"{total_last_updated_df['Confirmed'].sum():,d}"],
+                                            html.H3(children=[f"{data['total_last_updated_df']['Confirmed'].sum():,d}"],
                                                     style={'color': '#e62e00', 'font-size': '1.5vw',
                                                            'margin-top': '0px'})]),
                                         html.Div(className='plate', id='NewDeaths', children=[
                                             html.H5(children=['New Deaths'],
                                                     style={'color': 'black', 'font-size': '0.7vw',
                                                            'margin-bottom': '10px'}),
-                                            html.H3(children=[f"{last_updated_df['New Deaths'].sum():,d}"],
+                                            html.H3(children=[f"{data['last_updated_df']['New Deaths'].sum():,d}"],
                                                     style={'color': '#cc0066', 'font-size': '1.5vw',
                                                            'margin-top': '0px'})]),
                                         html.Div(className='plate', id='TotalDeaths', children=[
                                             html.H5(children=['Total Deaths'],
                                                     style={'color': 'black', 'font-size': '0.7vw',
                                                            'margin-bottom': '10px'}),
-                                            html.H3(children=[f"{total_last_updated_df['Deaths'].sum():,d}"],
+                                            html.H3(children=[f"{data['total_last_updated_df']['Deaths'].sum():,d}"],
                                                     style={'color': '#cc0066', 'font-size': '1.5vw',
                                                            'margin-top': '0px'})]),
                                         html.Div(className='plate', id='Active', children=[
                                             html.H5(children=['Active'], style={'color': 'black', 'font-size': '0.7vw',
                                                                                 'margin-bottom': '10px'}),
-                                            html.H3(children=[f"{total_last_updated_df['Active'].sum():,d}"],
+                                            html.H3(children=[f"{data['total_last_updated_df']['Active'].sum():,d}"],
                                                     style={'color': '#0099cc', 'font-size': '1.5vw',
                                                            'margin-top': '0px'})]),
                                         html.Div(className='plate', id='Recovered', children=[
                                             html.H5(children=['Recovered'],
                                                     style={'color': 'black', 'font-size': '0.7vw',
                                                            'margin-bottom': '10px'}),
-                                            html.H3(children=[f"{total_last_updated_df['Recovered'].sum():,d}"],
+                                            html.H3(children=[f"{data['total_last_updated_df']['Recovered'].sum():,d}"],
                                                     style={'color': '#339966', 'font-size': '1.5vw',
                                                            'margin-top': '0px'})])]),
 
-                                    html.Div(className='map', children=[
-                                        dcc.Graph(figure=update_map_graph())]),
+                                    html.Div(className='map', children=map_graph()),
 
                                     html.Div(className='title2', children=[
                                         html.H1(children='Cases vs Deaths over time',
@@ -352,9 +1147,28 @@ def visualise_dash():
                                         html.Div(className='dd1', children=[
                                             dcc.Dropdown(
                                                 id='country',
-                                                options=[{'label': i, 'value': i} for i in sorted(shown_countries)],
+                                                options=[{'label': i, 'value': i}
+                                                         for i in sorted(data['shown_countries'])],
+                                                multi=False,
+                                                value=DEFAULT_COUNTRY,
+                                                style={'textAlign': 'center',
+                                                       'color': 'black',
+                                                       'backgroundColor': 'white'})]),
+                                        # Options are the provinces/counties of the chosen country, see
+                                        # update_province_options & update_county_options
+                                        html.Div(className='dd1', children=[
+                                            dcc.Dropdown(
+                                                id='province',
+                                                placeholder='All provinces/states',
+                                                multi=False,
+                                                style={'textAlign': 'center',
+                                                       'color': 'black',
+                                                       'backgroundColor': 'white'})]),
+                                        html.Div(className='dd1', children=[
+                                            dcc.Dropdown(
+                                                id='county',
+                                                placeholder='All counties',
                                                 multi=False,
-                                                value='United Kingdom',
                                                 style={'textAlign': 'center',
                                                        'color': 'black',
                                                        'backgroundColor': 'white'})]),
@@ -369,7 +1183,20 @@ def visualise_dash():
                                                        'textAlign': 'center',
                                                        'color': 'black',
                                                        'backgroundColor': 'white'})]),
+                                        html.Div(className='dd2', children=[
+                                            dcc.Dropdown(
+                                                id='bar-metric',
+                                                options=[{'label': label, 'value': metric}
+                                                         for metric, (label, column) in BAR_METRICS.items()],
+                                                multi=False,
+                                                clearable=False,
+                                                value='New',
+                                                style={'width': '220px',
+                                                       'textAlign': 'center',
+                                                       'color': 'black',
+                                                       'backgroundColor': 'white'})]),
                                         html.Div(className='bar', children=[
+                                            dcc.Store(id='country-store'),
                                             dcc.Graph(id='Bar1')])]),
 
                                     html.Div(className='title4'),
@@ -391,55 +1218,277 @@ def visualise_dash():
                                                 style={'textAlign': 'right',
                                                        'color': 'black',
                                                        'backgroundColor': 'white'}),
+                                            dcc.Store(id='totals-store', data=pie_store(data)),
                                             dcc.Graph(id='Pie')])])])
 
-    @app.callback(dash.dependencies.Output('Pie', 'figure'),
-                  [dash.dependencies.Input('casesordeaths2', 'value')])
-    def update_pie_graph(c_or_d2):
-        bar_df = total_df.copy()
-        # Format the Percentage columns to show two decimal digits
-        # pie1_df['Percentage_Cases_per_Country'] = pie1_df['Percentage_Cases_per_Country'].apply('{:.4f}%'.format)
-        # pie1_df['Percentage_Deaths_per_Country'] = pie1_df['Percentage_Deaths_per_Country'].apply('{:.4f}%'.format)
-
-        fig_pie = px.sunburst(data_frame=bar_df,
-                              path=['Continent', 'Location'],
-                              values=c_or_d2,
-                              hover_name=bar_df['Last Update'],
-                              hover_data=['Confirmed', 'Deaths', 'Active', 'Recovered'],
-                              color_discrete_sequence=px.colors.qualitative.Safe
-                              )
-
-        fig_pie.update_layout(
-            title_x=0.5,
-            height=600,
-            geo=dict(
-                showframe=False,
-                showcoastlines=False))
-        return fig_pie
-
-    @app.callback([dash.dependencies.Output('Bar1', 'figure'),
+
+def map_columns(data):
+    """
+    :return list: columns of the cube (dates) shown on the map, every MAP_FRAME_STEP days up to the most recent date
+    """
+    last = len(data['dates']) - 1
+    return list(range(last % MAP_FRAME_STEP, last + 1, MAP_FRAME_STEP))
+
+
+@timed_stage
+def prepare_map(data):
+    """
+    This function precomputes the map of every date shown: one figure (of the most recent date)
+    and, for every date, only the values that change, compressed
+    :return dict:
+    """
+    rows = shown_rows(data)
+    columns = map_columns(data)
+    confirmed = data['cube'][rows, :, METRICS.index('Total Confirmed')]
+    fig = px.choropleth(data_frame=cube_frame(data, columns[-1:]),
+                        locations="ISO3",
+                        color='Total Confirmed',
+                        hover_name='Location',
+                        range_color=[10, max(confirmed.max(initial=0), 10)],
+                        color_continuous_scale=MAP_COLOR_SCALE)
+    fig.update_traces(hovertemplate='<b>%{hovertext}</b><br><br>Total Confirmed=%{z}<br>'
+                                    'Total Deaths=%{customdata[0]}<extra></extra>')
+    fig.update_layout(height=600,
+                      title_x=0.5,
+                      geo=dict(
+                          showframe=False,
+                          showcoastlines=False
+                      ))
+
+    values = data['cube'][np.ix_(rows, columns, [METRICS.index('Total Confirmed'), METRICS.index('Total Deaths')])]
+    frames = {}
+    for i, column in enumerate(columns):
+        frame = {'z': values[:, i, 0].tolist(), 'customdata': values[:, i, 1:].tolist()}
+        frames[column] = zlib.compress(json.dumps(frame).encode())
+    return {'version': data['version'],
+            'figure': json.loads(json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)),
+            'frames': frames,
+            'titles': {column: data['dates'][column].strftime('%d %B %Y') for column in columns}}
+
+
+def map_figure(frames, column):
+    """
+    This function creates the map of one date from the precomputed map, see prepare_map
+    :return dict:
+    """
+    trace = dict(frames['figure']['data'][0], **json.loads(zlib.decompress(frames['frames'][column])))
+    layout = dict(frames['figure']['layout'], title={'text': frames['titles'][column], 'x': 0.5})
+    return {'data': [trace], 'layout': layout}
+
+
+def pie_graph(data, c_or_d2):
+    bar_df = data['total_df'].copy()
+    # Format the Percentage columns to show two decimal digits
+    # pie1_df['Percentage_Cases_per_Country'] = pie1_df['Percentage_Cases_per_Country'].apply('{:.4f}%'.format)
+    # pie1_df['Percentage_Deaths_per_Country'] = pie1_df['Percentage_Deaths_per_Country'].apply('{:.4f}%'.format)
+
+    fig_pie = px.sunburst(data_frame=bar_df,
+                          path=['Continent', 'Location'],
+                          values=c_or_d2,
+                          hover_name=bar_df['Last Update'],
+                          hover_data=['Confirmed', 'Deaths', 'Active', 'Recovered'],
+                          color_discrete_sequence=px.colors.qualitative.Safe
+                          )
+
+    fig_pie.update_layout(
+        title_x=0.5,
+        height=600,
+        geo=dict(
+            showframe=False,
+            showcoastlines=False))
+    return fig_pie
+
+
+@timed_stage
+def pie_store(data):
+    """
+    This function creates the contents of the totals-store: the sunburst of the Confirmed cases and, for Confirmed
+    & Deaths, the properties of its trace that change with the dropdown. The browser switches between them
+    (see pie_figure in assets/clientside.js) without asking the server
+    :return dict:
+    """
+    figures = {c_or_d2: json.loads(json.dumps(pie_graph(data, c_or_d2), cls=plotly.utils.PlotlyJSONEncoder))
+               for c_or_d2 in ['Confirmed', 'Deaths']}
+    trace = figures['Confirmed']['data'][0]
+    return {'figure': figures['Confirmed'],
+            'traces': {c_or_d2: {key: value for key, value in figure['data'][0].items() if value != trace[key]}
+                       for c_or_d2, figure in figures.items()}}
+
+
+def bar_values(values):
+    # Derived metrics are shown with 1 decimal
+    return json_values(values.round(1) if values.dtype.kind == 'f' else values)
+
+
+def country_series(data, chosen_country, province, county, metric='New'):
+    """
+    This function creates the contents of the country-store: the dates and the values of a metric of one location
+    (or a province/county of it), for Confirmed & Deaths. The browser draws the bar chart of either one
+    (see bar_figure in assets/clientside.js) without asking the server
+    :return dict:
+    """
+    bar1_df = location_frame(data, chosen_country, province, county)
+    column = BAR_METRICS[metric][1]
+    series = {'location': ' / '.join(name for name in [chosen_country, province, county] if name),
+              'dates': [day.strftime('%Y-%m-%d') for day in bar1_df['Date']],
+              'column': column,
+              'values': {c_or_d3: bar_values(bar1_df[column.format(c_or_d3)].to_numpy())
+                         for c_or_d3 in ['Confirmed', 'Deaths']}}
+    if metric == 'New':
+        # The 7-day average is drawn over the new cases per day
+        series['averages'] = {c_or_d3: bar_values(bar1_df['7-day Average ' + c_or_d3].to_numpy())
+                              for c_or_d3 in ['Confirmed', 'Deaths']}
+    return series
+
+
+def split_filter_part(filter_part):
+    """
+    This function splits one part of a table filter, eg. '{Confirmed} > 1000'
+    :return tuple: column, operator, value (None if the part is not understood)
+    """
+    match = FILTER_PART.match(filter_part)
+    operator = FILTER_OPERATORS.get(match.group(2).lower()) if match else None
+    if operator is None:
+        return None, None, None
+    name, value_part = match.group(1), match.group(3).strip()
+    if len(value_part) > 1 and value_part[0] in ("'", '"', '`') and value_part[0] == value_part[-1]:
+        return name, operator, value_part[1:-1]
+    if operator == 'contains':
+        return name, operator, value_part
+    try:
+        return name, operator, float(value_part)
+    except ValueError:
+        return name, operator, value_part
+
+
+def filter_table(table_df, filter_query):
+    """
+    This function finds the rows of the table that match a filter, eg. '{Location} contains UK && {Deaths} > 10'
+    :return np.ndarray: bool for every row
+    """
+    mask = np.ones(len(table_df), dtype=bool)
+    for filter_part in (filter_query or '').split(' && '):
+        name, operator, value = split_filter_part(filter_part)
+        if name not in table_df.columns:
+            continue
+        column = table_df[name]
+        if operator == 'contains':
+            mask &= column.astype(str).str.contains(str(value), case=False, regex=False).to_numpy()
+        elif column.dtype.kind in 'iuf' and not isinstance(value, float):
+            # Numeric columns can't be compared to text
+            mask[:] = False
+        elif column.dtype.kind not in 'iuf' and operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            # Text columns are compared as text, also to numbers
+            text = value if isinstance(value, str) else '{:g}'.format(value)
+            mask &= getattr(column.astype(str), operator)(text).to_numpy()
+        elif operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            mask &= getattr(column, operator)(value).to_numpy()
+    return mask
+
+
+def table_page(data, page_current, page_size, sort_by, filter_query):
+    """
+    This function finds the rows of one page of the table, using the precomputed order of the sorted column.
+    Only the numbers of these rows are formatted
+    :return tuple: rows of the page, number of pages
+    """
+    table_df = data['table_df']
+    # Columns that are not in the table are not sorted, the rows keep the default order
+    if sort_by and sort_by[0].get('column_id') in data['table_order']:
+        order = data['table_order'][sort_by[0]['column_id']]
+        if sort_by[0].get('direction') == 'desc':
+            order = order[::-1]
+    else:
+        order = data['table_order']['Confirmed'][::-1]
+
+    mask = filter_table(table_df, filter_query)
+    order = order[mask[order]]
+    page_df = table_df.iloc[order[page_current * page_size:(page_current + 1) * page_size]].copy()
+    for column in ['Confirmed', 'Deaths', 'Recovered', 'Active']:
+        page_df[column] = page_df[column].apply('{:,}'.format)
+    return page_df.to_dict('records'), max(-(-len(order) // page_size), 1)
+
+
+def visualise_dash():
+    @app.callback([dash.dependencies.Output('table', 'data'),
+                   dash.dependencies.Output('table', 'page_count')],
+                  [dash.dependencies.Input('table', 'page_current'),
+                   dash.dependencies.Input('table', 'page_size'),
+                   dash.dependencies.Input('table', 'sort_by'),
+                   dash.dependencies.Input('table', 'filter_query')])
+    @timed_callback
+    def update_table(page_current, page_size, sort_by, filter_query):
+        return table_page(dataset, page_current or 0, page_size or TABLE_PAGE_SIZE, sort_by, filter_query)
+
+    if MAP_MODE == 'lazy':
+        @app.callback(dash.dependencies.Output('Map', 'figure'),
+                      [dash.dependencies.Input('map-date', 'value')])
+        @timed_callback
+        def update_map_graph(column):
+            frames = map_frames
+            # Pages loaded before a refresh may ask for a date that is not shown anymore
+            if not isinstance(column, int) or column not in frames['frames']:
+                column = max(frames['frames'])
+            return cached_figure(frames['version'], 'Map', [column], lambda: map_figure(frames, column))
+
+    # Switching between Confirmed & Deaths is drawn by the browser from the stores, see assets/clientside.js
+    app.clientside_callback(dash.dependencies.ClientsideFunction(namespace='dashboard', function_name='pie_figure'),
+                            dash.dependencies.Output('Pie', 'figure'),
+                            [dash.dependencies.Input('totals-store', 'data'),
+                             dash.dependencies.Input('casesordeaths2', 'value')])
+
+    app.clientside_callback(dash.dependencies.ClientsideFunction(namespace='dashboard', function_name='bar_figure'),
+                            dash.dependencies.Output('Bar1', 'figure'),
+                            [dash.dependencies.Input('country-store', 'data'),
+                             dash.dependencies.Input('casesordeaths3', 'value')])
+
+    @app.callback([dash.dependencies.Output('province', 'options'),
+                   dash.dependencies.Output('province', 'value')],
+                  [dash.dependencies.Input('country', 'value')])
+    @timed_callback
+    def update_province_options(chosen_country):
+        provinces = dataset['region_tree'].get(chosen_country, {})
+        return [{'label': province, 'value': province} for province in provinces if province], None
+
+    @app.callback([dash.dependencies.Output('county', 'options'),
+                   dash.dependencies.Output('county', 'value')],
+                  [dash.dependencies.Input('country', 'value'),
+                   dash.dependencies.Input('province', 'value')])
+    @timed_callback
+    def update_county_options(chosen_country, province):
+        counties = dataset['region_tree'].get(chosen_country, {}).get(province, [])
+        return [{'label': county, 'value': county} for county in counties], None
+
+    @app.callback([dash.dependencies.Output('country-store', 'data'),
                    dash.dependencies.Output('status', "children")],
                   [dash.dependencies.Input('country', 'value'),
-                   dash.dependencies.Input('casesordeaths3', 'value')])
-    def update_bar1_graph(chosen_country, c_or_d3):
-        bar1_df = confirmed_deaths_df[confirmed_deaths_df['Location'] == chosen_country].copy()
-        pie1_df = total_df[total_df['Location'] == chosen_country].copy()
-
-        # bar1_df.loc[:, 'Cases'] = bar1_df.loc[:, 'Cases'].apply('{:,}'.format)
-        # bar1_df.loc[:, 'Deaths'] = bar1_df.loc[:, 'Deaths'].apply('{:,}'.format)
-        pie1_df.loc[:, 'Confirmed'] = pie1_df.loc[:, 'Confirmed'].copy().astype(int).apply('{:,}'.format)
-        pie1_df.loc[:, 'Deaths'] = pie1_df.loc[:, 'Deaths'].copy().astype(int).apply('{:,}'.format)
-        pie1_df.loc[:, 'Mortality_Rate'] = pie1_df.loc[:, 'Mortality_Rate'].copy().astype(int).apply('{:.2f}%'.format)
-
-        fig = px.bar(data_frame=bar1_df,
-                     x='Date',
-                     y='New ' + c_or_d3,
-                     text='New ' + c_or_d3,
-                     orientation='v',
-                     hover_data=['Location', 'Date', 'New ' + c_or_d3],
-                     template='none'
-                     )
-        fig.update_layout(height=500)
+                   dash.dependencies.Input('province', 'value'),
+                   dash.dependencies.Input('county', 'value'),
+                   dash.dependencies.Input('bar-metric', 'value')])
+    @timed_callback
+    def update_country_series(chosen_country, province, county, metric):
+        data = dataset
+        # Inputs come from the browser: unknown ones are neither counted nor cached, the page keeps what it shows
+        if not all(isinstance(value, (str, type(None))) for value in [chosen_country, province, county, metric]) or \
+                metric not in BAR_METRICS or location_row(data, chosen_country, province, county)[2] is None:
+            raise dash.exceptions.PreventUpdate
+        country_views[chosen_country] += 1
+        series = cached_figure(data['version'], 'Series', [chosen_country, province or '', county or '', metric],
+                               lambda: country_series(data, chosen_country, province, county, metric))
+
+        if province:
+            # Provinces & counties are not in the cases_country .csv, their status is read from the region cube
+            cube, derived, row = location_row(data, chosen_country, province, county)
+            confirmed, deaths = (cube[row, -1, [METRICS.index('Total Confirmed'), METRICS.index('Total Deaths')]]
+                                 if row is not None else (0, 0))
+            pie1_df = pd.DataFrame({'Confirmed': ['{:,}'.format(confirmed)], 'Deaths': ['{:,}'.format(deaths)],
+                                    'Mortality_Rate': ['{:.2f}%'.format(100 * deaths / max(confirmed, 1))]})
+        else:
+            pie1_df = data['total_df'][data['total_df']['Location'] == chosen_country].copy()
+            pie1_df.loc[:, 'Confirmed'] = pie1_df.loc[:, 'Confirmed'].copy().astype(int).apply('{:,}'.format)
+            pie1_df.loc[:, 'Deaths'] = pie1_df.loc[:, 'Deaths'].copy().astype(int).apply('{:,}'.format)
+            pie1_df.loc[:, 'Mortality_Rate'] = pie1_df.loc[:, 'Mortality_Rate'].copy().astype(int).apply(
+                '{:.2f}%'.format)
 
         status = html.Div(className='plates1', id='NewCases', children=[
             html.Div(className='plate1', id='TotalCases', children=[
@@ -463,7 +1512,7 @@ def visualise_dash():
                         style={'color': '#0099cc', 'font-size': '1.5vw',
                                'margin-top': '0px'})])])
 
-        return fig, status
+        return series, status
 
     if __name__ == '__main__':
         app.run_server()
@@ -472,3 +1521,5 @@ def visualise_dash():
 prepare_data(Confirmed_url=Confirmed_url, Deaths_url=Deaths_url, Recovered_url=Recovered_url, total_url=total_url,
              continent_url=continent_url)
 visualise_dash()
+start_refresher()
+start_profiler()
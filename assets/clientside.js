@@ -0,0 +1,60 @@
+// Callbacks run by the browser, the Confirmed/Deaths dropdowns only switch between data already in the stores
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    dashboard: {
+        // Sunburst of the continents & locations, see pie_store in app.py
+        pie_figure: function (store, c_or_d2) {
+            if (!store) {
+                return window.dash_clientside.no_update;
+            }
+            var trace = Object.assign({}, store.figure.data[0], store.traces[c_or_d2]);
+            return {data: [trace], layout: store.figure.layout};
+        },
+
+        // Bar chart of one location, see country_series in app.py
+        bar_figure: function (series, c_or_d3) {
+            if (!series) {
+                return window.dash_clientside.no_update;
+            }
+            var column = series.column.replace('{}', c_or_d3);
+            var values = series.values[c_or_d3];
+            var data = [{
+                type: 'bar',
+                x: series.dates,
+                y: values,
+                text: values,
+                textposition: 'auto',
+                orientation: 'v',
+                name: '',
+                showlegend: false,
+                marker: {color: '#1F77B4'},
+                alignmentgroup: 'True',
+                offsetgroup: '',
+                hovertemplate: 'Date=%{x}<br>' + column + '=%{y}<br>Location=' + series.location +
+                    '<extra></extra>'
+            }];
+            if (series.averages) {
+                // The 7-day average is drawn over the new cases per day
+                data.push({
+                    type: 'scatter',
+                    mode: 'lines',
+                    name: '7-day average',
+                    x: series.dates,
+                    y: series.averages[c_or_d3],
+                    line: {color: 'black'},
+                    showlegend: false
+                });
+            }
+            return {
+                data: data,
+                layout: {
+                    height: 500,
+                    barmode: 'relative',
+                    legend: {tracegroupgap: 0},
+                    margin: {t: 60},
+                    xaxis: {title: {text: 'Date'}},
+                    yaxis: {title: {text: column}}
+                }
+            };
+        }
+    }
+});
@@ -0,0 +1,136 @@
+"""
+Writes synthetic .csv files with the same columns as the Johns Hopkins University data used by the dashboard
+(time series of confirmed/deaths/recovered, cases_country.csv and the continents file), eg.
+    python benchmarks/generate_data.py fixtures --locations 200 --days 100 --counties 3300
+The directory can then be used with DATA_DIR=fixtures (and COUNTY_LEVEL=1 to read the counties)
+"""
+import os
+import argparse
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+
+CONTINENTS = ['Africa', 'Asia', 'Europe', 'North America', 'Oceania', 'South America']
+FIRST_DAY = date(2020, 1, 22)
+
+
+def location_names(locations):
+    # The dashboard shows the United Kingdom when the page is loaded
+    return ['United Kingdom'] + ['Location {:05d}'.format(i) for i in range(1, locations)]
+
+
+def time_series(rng, names, days, rate):
+    """
+    This function creates the totals of every location for every day, growing at a different speed
+    for every location, with a few corrections (totals going down) like the real data has
+    :return np.ndarray: locations x days
+    """
+    speed = rng.uniform(0.2, 1.0, size=(len(names), 1))
+    expected = rate * speed * np.linspace(0, 1, days) ** 2
+    new = rng.poisson(expected)
+    totals = new.cumsum(axis=1)
+    corrections = rng.random(totals.shape) < 0.001
+    totals[corrections] = (totals[corrections] * 0.9).astype(totals.dtype)
+    return totals
+
+
+def write_time_series(path, rng, names, provinces, totals, dates):
+    df = pd.DataFrame(totals[provinces['location']], columns=dates)
+    df.insert(0, 'Long', rng.uniform(-180, 180, len(df)).round(4))
+    df.insert(0, 'Lat', rng.uniform(-60, 70, len(df)).round(4))
+    df.insert(0, 'Country/Region', [names[i] for i in provinces['location']])
+    df.insert(0, 'Province/State', provinces['province'])
+    df.to_csv(path, index=False)
+
+
+def write_county_series(path, rng, location, totals, dates, population=None):
+    counties = len(totals)
+    df = pd.DataFrame(totals, columns=dates)
+    if population is not None:
+        df.insert(0, 'Population', population)
+    columns = {'UID': 84000000 + np.arange(counties),
+               'iso2': 'US',
+               'iso3': 'USA',
+               'code3': 840,
+               'FIPS': np.arange(counties) + 1000.0,
+               'Admin2': ['County {:04d}'.format(i) for i in range(counties)],
+               'Province_State': ['State {:02d}'.format(i % 50) for i in range(counties)],
+               'Country_Region': location,
+               'Lat': rng.uniform(20, 60, counties).round(4),
+               'Long_': rng.uniform(-160, -70, counties).round(4)}
+    columns['Combined_Key'] = ['{}, {}, {}'.format(county, state, location)
+                               for county, state in zip(columns['Admin2'], columns['Province_State'])]
+    for position, (name, values) in enumerate(columns.items()):
+        df.insert(position, name, values)
+    df.to_csv(path, index=False)
+
+
+def generate(directory, locations=200, days=100, seed=0, counties=0):
+    """
+    This function writes the five .csv files into directory, and the two US county .csv files if counties > 0
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    names = location_names(locations)
+    days_list = [FIRST_DAY + timedelta(days=day) for day in range(days)]
+    dates = ['{}/{}/{:%y}'.format(day.month, day.day, day) for day in days_list]
+
+    # Every 10th location is split in 3 provinces, which the dashboard sums up
+    provinces = {'location': [], 'province': []}
+    for i in range(locations):
+        for province in (['Province A', 'Province B', None] if i % 10 == 9 else [None]):
+            provinces['location'].append(i)
+            provinces['province'].append(province)
+    provinces['location'] = np.array(provinces['location'])
+
+    confirmed = time_series(rng, names, days, 2000)
+    deaths = (confirmed * rng.uniform(0.005, 0.05, size=(locations, 1))).astype(np.int64)
+    recovered = (confirmed * rng.uniform(0.3, 0.9, size=(locations, 1))).astype(np.int64)
+    for name, totals in [('confirmed', confirmed), ('deaths', deaths), ('recovered', recovered)]:
+        # Provinces get a share of the totals of their location
+        shares = np.where(pd.Series(provinces['location']).duplicated(keep=False), 1 / 3, 1.0)
+        write_time_series(os.path.join(directory, 'time_series_covid19_{}_global.csv'.format(name)), rng, names,
+                          provinces, (totals[provinces['location']] * shares[:, None]).astype(np.int64), dates)
+
+    last = {'Confirmed': confirmed[:, -1], 'Deaths': deaths[:, -1], 'Recovered': recovered[:, -1]}
+    total_df = pd.DataFrame({'Country_Region': names,
+                             'Last_Update': '{} 04:32:11'.format(days_list[-1] + timedelta(days=1)),
+                             'Lat': rng.uniform(-60, 70, locations).round(4),
+                             'Long_': rng.uniform(-180, 180, locations).round(4),
+                             'Confirmed': last['Confirmed'].astype(float),
+                             'Deaths': last['Deaths'].astype(float),
+                             'Recovered': last['Recovered'].astype(float),
+                             'Active': (last['Confirmed'] - last['Deaths'] - last['Recovered']).astype(float),
+                             'Incident_Rate': rng.uniform(1, 5000, locations).round(3),
+                             'People_Tested': np.nan,
+                             'People_Hospitalized': np.nan,
+                             'Mortality_Rate': (100 * last['Deaths'] / np.maximum(last['Confirmed'], 1)).round(3),
+                             'UID': np.arange(locations),
+                             'ISO3': ['{:03d}'.format(i) if i else 'GBR' for i in range(locations)]})
+    total_df.to_csv(os.path.join(directory, 'cases_country.csv'), index=False)
+
+    # A few locations have no continent, as in the real data
+    continent_df = pd.DataFrame({'Continent': [CONTINENTS[i % len(CONTINENTS)] for i in range(locations)],
+                                 'Country': names})
+    continent_df.iloc[:int(locations * 0.95)].to_csv(os.path.join(directory, 'Countries-Continents.csv'), index=False)
+
+    if counties:
+        # Counties of the second location, in 50 states that are not in the global time series
+        county_confirmed = time_series(rng, range(counties), days, 200)
+        county_deaths = (county_confirmed * rng.uniform(0.005, 0.05, size=(counties, 1))).astype(np.int64)
+        location = names[min(1, locations - 1)]
+        write_county_series(os.path.join(directory, 'time_series_covid19_confirmed_US.csv'), rng, location,
+                            county_confirmed, dates)
+        write_county_series(os.path.join(directory, 'time_series_covid19_deaths_US.csv'), rng, location,
+                            county_deaths, dates, rng.integers(1000, 1000000, counties))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory')
+    parser.add_argument('--locations', type=int, default=200)
+    parser.add_argument('--days', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--counties', type=int, default=0)
+    arguments = parser.parse_args()
+    generate(arguments.directory, arguments.locations, arguments.days, arguments.seed, arguments.counties)
@@ -0,0 +1,259 @@
+"""
+Serves the dashboard with gunicorn on synthetic data (see generate_data.py) and replays a mix of page loads and
+callbacks through many concurrent clients, for several gunicorn settings, eg.
+    python benchmarks/load_test.py --locations 1000 --days 500 --configs 1x1 4x1 2x4 --clients 50 --duration 30
+Configs are workers x threads. Throughput, p50/p95/p99 latency and bytes per response are reported for every
+config and request of the mix, eg. --mix layout=1 series=6 table=2 map=1. --env FIGURE_CACHE_SIZE=0 runs the
+app with other settings, to compare caching strategies
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generate_data import generate, location_names
+
+BAR_METRICS = ['New', 'Average', 'Growth', 'Doubling', 'Per100k']
+# Requests of the default mix & how often each one is sent
+DEFAULT_MIX = ['layout=1', 'series=6', 'provinces=2', 'table=2', 'map=1', 'api=1']
+# Seconds the app has to become ready (it prepares the data of the first config)
+START_TIMEOUT = 600
+
+
+def callback_body(output, inputs):
+    """
+    This function creates the body of a callback request, like the browser sends it
+    :return bytes:
+    """
+    return json.dumps({'output': output, 'outputs': None, 'state': [],
+                       'inputs': [{'id': component, 'property': prop, 'value': value}
+                                  for component, prop, value in inputs],
+                       'changedPropIds': ['{}.{}'.format(component, prop) for component, prop, value in inputs]}
+                      ).encode()
+
+
+def request_makers(countries, days):
+    """
+    Countries are chosen with weights 1, 1/2, 1/3...: a few countries are asked for often, most of them rarely
+    :return dict: name of every request of the mix -> function returning its method, path & body
+    """
+    weights = [1 / (rank + 1) for rank in range(len(countries))]
+
+    def country():
+        return random.choices(countries, weights)[0]
+
+    return {'layout': lambda: ('GET', '/_dash-layout', None),
+            'series': lambda: ('POST', '/_dash-update-component', callback_body(
+                '..country-store.data...status.children..',
+                [('country', 'value', country()), ('province', 'value', None), ('county', 'value', None),
+                 ('bar-metric', 'value', random.choice(BAR_METRICS))])),
+            'provinces': lambda: ('POST', '/_dash-update-component', callback_body(
+                '..province.options...province.value..', [('country', 'value', country())])),
+            'table': lambda: ('POST', '/_dash-update-component', callback_body(
+                '..table.data...table.page_count..',
+                [('table', 'page_current', random.randrange(5)), ('table', 'page_size', 20),
+                 ('table', 'sort_by', [{'column_id': random.choice(['Confirmed', 'Deaths']), 'direction': 'desc'}]),
+                 ('table', 'filter_query', '')])),
+            'map': lambda: ('POST', '/_dash-update-component', callback_body(
+                'Map.figure', [('map-date', 'value', random.randrange(days))])),
+            'api': lambda: ('GET', '/api/v1/series?location={}&metric=New Confirmed'.format(country()), None)}
+
+
+async def read_response(reader):
+    """
+    This function reads one HTTP/1.1 response
+    :return tuple: status, body (as sent, maybe compressed) & whether the connection can be used again
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('The server closed the connection')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, value = line.decode('latin-1').split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+
+    if 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            chunks.append(await reader.readexactly(size + 2))
+            if size == 0:
+                break
+        body = b''.join(chunk[:-2] for chunk in chunks)
+    else:
+        body = await reader.read()
+        headers['connection'] = 'close'
+    return status, body, headers.get('connection', '').lower() != 'close'
+
+
+async def client(port, mix, makers, deadline, results):
+    """
+    This function sends requests of the mix one after the other until the deadline, over a keep-alive connection
+    (opened again if the server closes it). Latency, size & status of every response are added to results
+    """
+    names, weights = zip(*mix.items())
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        name = random.choices(names, weights)[0]
+        method, path, body = makers[name]()
+        request = ['{} {} HTTP/1.1'.format(method, path.replace(' ', '%20')), 'Host: 127.0.0.1:{}'.format(port),
+                   'Accept-Encoding: gzip, br', 'Connection: keep-alive']
+        if body is not None:
+            request += ['Content-Type: application/json', 'Content-Length: {}'.format(len(body))]
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(('\r\n'.join(request) + '\r\n\r\n').encode() + (body or b''))
+            await writer.drain()
+            status, response, keep_alive = await read_response(reader)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            status, response, keep_alive = 0, b'', False
+        results.append((name, time.perf_counter() - start, len(response), status))
+        if not keep_alive and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run_clients(port, clients, mix, makers, seconds):
+    results = []
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(*[client(port, mix, makers, deadline, results) for _ in range(clients)])
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(port, process, timeout=START_TIMEOUT):
+    """
+    This function waits until /readyz answers 200, ie. a worker shows some version of the data
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited with code {}'.format(process.returncode))
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=5) as s:
+                s.sendall(b'GET /readyz HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n')
+                if s.recv(64).split(b' ')[1:2] == [b'200']:
+                    return
+        except (OSError, IndexError):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError('The app was not ready after {} seconds'.format(timeout))
+
+
+def start_server(workers, threads, port, env):
+    command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+               '--bind', '127.0.0.1:{}'.format(port), '--chdir', ROOT, '--log-level', 'warning', 'app:server']
+    return subprocess.Popen(command, env=dict(os.environ, **env))
+
+
+def percentile(values, fraction):
+    # Nearest rank of sorted values
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+def summarize(results, seconds):
+    """
+    This function computes throughput, latency percentiles and mean bytes of every request of the mix
+    (and of all of them, as 'all')
+    :return dict: name -> summary
+    """
+    summaries = {}
+    for name in sorted({result[0] for result in results}) + ['all']:
+        chosen = [result for result in results if name in ('all', result[0])]
+        if not chosen:
+            continue
+        latencies = sorted(1000 * result[1] for result in chosen)
+        ok = [result for result in chosen if 200 <= result[3] < 400]
+        summaries[name] = {'requests': len(chosen), 'per_second': len(chosen) / seconds,
+                           'p50_ms': percentile(latencies, 0.50), 'p95_ms': percentile(latencies, 0.95),
+                           'p99_ms': percentile(latencies, 0.99),
+                           'bytes': sum(result[2] for result in ok) / max(len(ok), 1),
+                           'errors': len(chosen) - len(ok)}
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--locations', type=int, default=200)
+    parser.add_argument('--days', type=int, default=100)
+    parser.add_argument('--counties', type=int, default=0)
+    parser.add_argument('--configs', nargs='+', default=['1x1', '2x1', '2x4'], help='gunicorn workers x threads')
+    parser.add_argument('--clients', type=int, default=20, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of measured traffic per config')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds of traffic before measuring')
+    parser.add_argument('--mix', nargs='+', default=DEFAULT_MIX, help='request=weight, of ' + ', '.join(
+        request_makers(['United Kingdom'], 1)))
+    parser.add_argument('--env', nargs='*', default=[], help='NAME=value settings of the app')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the results to this file')
+    arguments = parser.parse_args()
+
+    random.seed(arguments.seed)
+    mix = {name: float(weight) for name, weight in (entry.split('=') for entry in arguments.mix)}
+    makers = request_makers(location_names(arguments.locations), arguments.days)
+    unknown = set(mix) - set(makers)
+    if unknown:
+        parser.error('unknown requests in --mix: {}'.format(', '.join(sorted(unknown))))
+
+    work_dir = tempfile.mkdtemp(prefix='load-test-')
+    data_dir = os.path.join(work_dir, 'data')
+    generate(data_dir, arguments.locations, arguments.days, counties=arguments.counties)
+    # Snapshots are shared by the configs: only the first one prepares the data
+    env = {'DATA_DIR': data_dir, 'SNAPSHOT_DIR': os.path.join(work_dir, 'snapshots'),
+           'DATA_CACHE_DIR': os.path.join(work_dir, 'cache'), 'REFRESH_INTERVAL': '0',
+           'COUNTY_LEVEL': '1' if arguments.counties else '0'}
+    env.update(entry.split('=', 1) for entry in arguments.env)
+
+    results = []
+    print('{:>8}  {:<10}{:>10}{:>10}{:>10}{:>10}{:>10}{:>12}{:>8}'.format(
+        'config', 'request', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'bytes', 'errors'))
+    for config in arguments.configs:
+        workers, threads = (int(value) for value in config.split('x'))
+        port = free_port()
+        process = start_server(workers, threads, port, env)
+        try:
+            wait_until_ready(port, process)
+            asyncio.run(run_clients(port, arguments.clients, mix, makers, arguments.warmup))
+            measured = asyncio.run(run_clients(port, arguments.clients, mix, makers, arguments.duration))
+        finally:
+            process.terminate()
+            process.wait()
+
+        for name, summary in summarize(measured, arguments.duration).items():
+            results.append(dict(summary, config=config, workers=workers, threads=threads, request=name,
+                                clients=arguments.clients))
+            print('{:>8}  {:<10}{:>10}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>12.0f}{:>8}'.format(
+                config, name, summary['requests'], summary['per_second'], summary['p50_ms'], summary['p95_ms'],
+                summary['p99_ms'], summary['bytes'], summary['errors']))
+
+    if arguments.json:
+        with open(arguments.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
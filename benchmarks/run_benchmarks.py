@@ -0,0 +1,175 @@
+"""
+Measures wall time and peak memory of every stage of the data pipeline and of every callback,
+on synthetic data (see generate_data.py) of several sizes, eg.
+    python benchmarks/run_benchmarks.py --scales 200x100 1000x500 5000x2000 --json results.json
+Scales are locations x days, --counties adds that many US counties to every scale
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generate_data import generate
+
+
+def run_stage(function, repeat):
+    """
+    This function runs a stage repeat times for its wall time and once more, traced, for its peak memory
+    :return dict:
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    measurement = {'median_ms': 1000 * statistics.median(seconds), 'best_ms': 1000 * min(seconds),
+                   'peak_mb': peak / 2 ** 20}
+    # Callbacks return the response, its size is measured too
+    if hasattr(result, 'status_code'):
+        measurement['bytes'] = len(result.data)
+    return measurement
+
+
+def drop_last_day(df):
+    return df.iloc[:, :-1]
+
+
+def pipeline_stages(app, sources):
+    """
+    :return list: name & function of every stage of the data pipeline
+    """
+    raw = sources.read_sources(app.data_urls)
+    totals = dict(zip(app.TIME_SERIES, [app.time_series_totals(df)[0] for df in raw[:3]]))
+    data = app.build_data(*raw)
+    # The county .csv files (if any) are after cases_country & the continents
+    previous = app.build_data(*[drop_last_day(df) for df in raw[:3]], *raw[3:5],
+                              *[drop_last_day(df) for df in raw[5:]])
+
+    return [('read_sources', lambda: sources.read_sources(app.data_urls)),
+            ('time_series_totals', lambda: [app.time_series_totals(df) for df in raw[:3]]),
+            ('build_cube', lambda: app.build_cube(totals)),
+            ('derive_metrics', lambda: app.derive_metrics(data['cube'], data['locations_df']['Population'].to_numpy())),
+            ('build_data', lambda: app.build_data(*raw)),
+            ('update_data (1 new day)', lambda: app.update_data(previous, *raw)),
+            ('prepare_map', lambda: app.prepare_map(data)),
+            ('pie_store', lambda: app.pie_store(data)),
+            ('build_layout', lambda: app.build_layout(data)),
+            ('publish', lambda: app.publish(data))]
+
+
+def callback_stages(app, figure_cache):
+    """
+    :return list: name & function of every callback, called through the Flask server like a browser does
+    """
+    client = app.server.test_client()
+    country = app.DEFAULT_COUNTRY
+    last_column = len(app.dataset['dates']) - 1
+
+    def callback(output, inputs, cold=False):
+        body = {'output': output, 'outputs': None, 'state': [],
+                'inputs': [{'id': component, 'property': prop, 'value': value} for component, prop, value in inputs],
+                'changedPropIds': ['{}.{}'.format(component, prop) for component, prop, value in inputs]}
+
+        def call():
+            if cold:
+                figure_cache.figures.clear()
+                # Figures on disk (eg. written by warm_figures) would be read instead of built
+                shutil.rmtree(os.path.join(figure_cache.SNAPSHOT_DIR, app.dataset['version'], 'figures'),
+                              ignore_errors=True)
+            return client.post('/_dash-update-component', json=body)
+
+        return call
+
+    series = ('..country-store.data...status.children..', [('country', 'value', country), ('province', 'value', None),
+                                                             ('county', 'value', None), ('bar-metric', 'value', 'New')])
+    stages = [('update_country_series (not cached)', callback(*series, cold=True)),
+              ('update_country_series (cached)', callback(*series)),
+              ('update_table', callback('..table.data...table.page_count..',
+                                        [('table', 'page_current', 3), ('table', 'page_size', app.TABLE_PAGE_SIZE),
+                                         ('table', 'sort_by', [{'column_id': 'Deaths', 'direction': 'desc'}]),
+                                         ('table', 'filter_query', '{Confirmed} > 100')])),
+              ('/_dash-layout (gzip)', lambda: client.get('/_dash-layout', headers={'Accept-Encoding': 'gzip'}))]
+    if app.COUNTY_LEVEL:
+        location, province, county = next(region for region in reversed(app.dataset['regions']) if region[2])
+        stages.append(('update_country_series (county)', callback(
+            '..country-store.data...status.children..',
+            [('country', 'value', location), ('province', 'value', province), ('county', 'value', county),
+             ('bar-metric', 'value', 'Average')],
+            cold=True)))
+        stages.append(('update_county_options', callback('..county.options...county.value..',
+                                                         [('country', 'value', location),
+                                                          ('province', 'value', province)])))
+    if app.MAP_MODE == 'lazy':
+        stages.append(('update_map_graph', callback('Map.figure', [('map-date', 'value', last_column)])))
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', nargs='+', default=['200x100', '1000x500'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--counties', type=int, default=0)
+    arguments = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='benchmarks-')
+    scales = [tuple(int(value) for value in scale.split('x')) for scale in arguments.scales]
+    for locations, days in scales:
+        generate(os.path.join(work_dir, '{}x{}'.format(locations, days)), locations, days, counties=arguments.counties)
+
+    # The app reads its data when it is imported: start with the smallest scale, without snapshots
+    # shared with a running dashboard and without refreshing in the background
+    os.environ['DATA_DIR'] = os.path.join(work_dir, '{}x{}'.format(*scales[0]))
+    os.environ['SNAPSHOT_DIR'] = os.path.join(work_dir, 'snapshots')
+    os.environ['DATA_CACHE_DIR'] = os.path.join(work_dir, 'cache')
+    os.environ['REFRESH_INTERVAL'] = '0'
+    os.environ['COUNTY_LEVEL'] = '1' if arguments.counties else '0'
+    import app
+    import sources
+    import snapshot
+    import figure_cache
+    # Without a snapshot the data is loaded in the background
+    app.data_checked.wait()
+
+    results = []
+    print('{:>10}  {:<36}{:>12}{:>12}{:>12}{:>12}'.format('scale', 'stage', 'median ms', 'best ms', 'peak MB',
+                                                          'bytes'))
+    for locations, days in scales:
+        scale = '{}x{}'.format(locations, days)
+        sources.DATA_DIR = os.path.join(work_dir, scale)
+        stages = pipeline_stages(app, sources)
+        data = app.build_data(*sources.read_sources(app.data_urls))
+        # Scales with the same days have the same version: every scale gets its own snapshots & figures
+        snapshot.SNAPSHOT_DIR = figure_cache.SNAPSHOT_DIR = os.path.join(work_dir, 'snapshots', scale)
+        snapshot.write_snapshot(data)
+        app.publish(data)
+        stages += callback_stages(app, figure_cache)
+
+        for name, function in stages:
+            measurement = run_stage(function, arguments.repeat)
+            results.append(dict(measurement, scale=scale, locations=locations, days=days, stage=name))
+            print('{:>10}  {:<36}{:>12.1f}{:>12.1f}{:>12.1f}{:>12}'.format(
+                scale, name, measurement['median_ms'], measurement['best_ms'], measurement['peak_mb'],
+                measurement.get('bytes', '')))
+
+    if arguments.json:
+        with open(arguments.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
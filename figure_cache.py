@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import plotly.utils
+from sources import write_atomic
+from snapshot import SNAPSHOT_DIR
+from metrics import increment, observe, SIZE_BUCKETS
+
+# Number of figures every worker keeps in memory
+FIGURE_CACHE_SIZE = int(os.environ.get('FIGURE_CACHE_SIZE', '256'))
+
+# Figures as JSON dicts, least recently used first
+figures = OrderedDict()
+figures_lock = threading.Lock()
+
+
+def figure_path(version, name, args):
+    """
+    Figures are written next to the snapshot of their version, so they are deleted with it
+    :return str:
+    """
+    key = hashlib.sha1(json.dumps([name] + list(args)).encode()).hexdigest()[:16]
+    return os.path.join(SNAPSHOT_DIR, version, 'figures', '{}-{}.json'.format(name, key))
+
+
+def read_figure(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def write_figure(path, figure_json):
+    # Only versions that have a snapshot are shared with the other workers
+    if not os.path.isdir(os.path.dirname(os.path.dirname(path))):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            f.write(figure_json)
+
+    write_atomic(path, write)
+
+
+def cached_figure(version, name, args, build):
+    """
+    This function finds the figure of a callback (name) for its inputs (args) and a version of the data.
+    Figures are kept in memory by every worker and on disk for all workers, build() is only called
+    if no worker has built the figure yet. A new version of the data never uses figures of an old one
+    :return dict: the figure, serialized and read back as JSON
+    """
+    key = (version, name) + tuple(args)
+    with figures_lock:
+        if key in figures:
+            figures.move_to_end(key)
+            increment('dashboard_figure_cache_total', figure=name, result='memory')
+            return figures[key]
+
+    path = figure_path(version, name, args)
+    figure_json = read_figure(path)
+    if figure_json is None:
+        figure_json = json.dumps(build(), cls=plotly.utils.PlotlyJSONEncoder)
+        write_figure(path, figure_json)
+        increment('dashboard_figure_cache_total', figure=name, result='miss')
+        observe('dashboard_figure_bytes', len(figure_json), buckets=SIZE_BUCKETS, figure=name)
+    else:
+        increment('dashboard_figure_cache_total', figure=name, result='disk')
+    figure = json.loads(figure_json)
+
+    with figures_lock:
+        figures[key] = figure
+        while len(figures) > FIGURE_CACHE_SIZE:
+            figures.popitem(last=False)
+    return figure
@@ -0,0 +1,166 @@
+import os
+import sys
+import time
+import functools
+import threading
+from collections import Counter
+
+# Upper bounds of the histogram buckets, in seconds and bytes
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+SIZE_BUCKETS = [1000, 10000, 100000, 1000000, 10000000]
+# Seconds between samples of the profiler, 0 to not profile
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0'))
+# Distinct stacks kept by the profiler, samples of other stacks are counted as 'other'
+PROFILE_MAX_STACKS = 10000
+
+DESCRIPTIONS = {'dashboard_stage_seconds': ('histogram', 'Time of every stage of preparing the data'),
+                'dashboard_callback_seconds': ('histogram', 'Time of every Dash callback'),
+                'dashboard_api_seconds': ('histogram', 'Time of every request to the time series API'),
+                'dashboard_payload_cache_total': ('counter', 'API payloads found in memory (hit) or built (miss)'),
+                'dashboard_figure_cache_total': ('counter', 'Figures found in memory, on disk or built (miss)'),
+                'dashboard_figure_bytes': ('histogram', 'Size of the figures built, serialized as JSON'),
+                'dashboard_layout_bytes': ('gauge', 'Size of the page layout, for every encoding'),
+                'dashboard_data_info': ('gauge', 'Version of the data shown'),
+                'dashboard_data_age_seconds': ('gauge', 'Seconds since the data shown was prepared'),
+                'dashboard_data_days': ('gauge', 'Number of days in the data shown'),
+                'dashboard_data_locations': ('gauge', 'Number of locations in the data shown')}
+
+metrics_lock = threading.Lock()
+# (name, labels) -> value
+counters = {}
+# (name, labels) -> [count of every bucket, sum, count]
+histograms = {}
+# name -> function returning a list of (labels, value)
+gauges = {}
+# Stacks sampled by the profiler -> number of samples
+profile = Counter()
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def increment(name, value=1, **labels):
+    key = (name, label_key(labels))
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    key = (name, label_key(labels))
+    with metrics_lock:
+        if key not in histograms:
+            histograms[key] = [buckets, [0] * len(buckets), 0, 0]
+        histogram = histograms[key]
+        for i, bound in enumerate(histogram[0]):
+            if value <= bound:
+                histogram[1][i] += 1
+        histogram[2] += value
+        histogram[3] += 1
+
+
+def register_gauge(name, function):
+    """
+    :param function: returns a list of (labels dict, value), read when the metrics are rendered
+    """
+    gauges[name] = function
+
+
+def timed(name, **labels):
+    """
+    This decorator records the time of every call of a function into the histogram name
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+def timed_stage(function):
+    """
+    This decorator records the time of a stage of preparing the data, named after the function
+    """
+    return timed('dashboard_stage_seconds', stage=function.__name__)(function)
+
+
+def timed_callback(function):
+    """
+    This decorator records the time of a Dash callback, named after the function
+    """
+    return timed('dashboard_callback_seconds', callback=function.__name__)(function)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in labels) + '}'
+
+
+def render():
+    """
+    This function writes all metrics in the Prometheus text format
+    :return str:
+    """
+    lines = []
+    with metrics_lock:
+        samples = {}
+        for (name, labels), value in counters.items():
+            samples.setdefault(name, []).append('{}{} {}'.format(name, format_labels(labels), value))
+        for (name, labels), (buckets, counts, total, count) in histograms.items():
+            for bound, bucket_count in zip(buckets, counts):
+                samples.setdefault(name, []).append('{}_bucket{} {}'.format(
+                    name, format_labels(labels + (('le', bound),)), bucket_count))
+            samples[name].append('{}_bucket{} {}'.format(name, format_labels(labels + (('le', '+Inf'),)), count))
+            samples[name].append('{}_sum{} {}'.format(name, format_labels(labels), total))
+            samples[name].append('{}_count{} {}'.format(name, format_labels(labels), count))
+    for name, function in gauges.items():
+        for labels, value in function():
+            samples.setdefault(name, []).append('{}{} {}'.format(name, format_labels(label_key(labels)), value))
+
+    for name in sorted(samples):
+        metric_type, description = DESCRIPTIONS.get(name, ('untyped', name))
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        lines.extend(samples[name])
+    return '\n'.join(lines) + '\n'
+
+
+def start_profiler(interval=PROFILE_INTERVAL):
+    """
+    This function starts a thread that samples the stack of every other thread every interval seconds.
+    Samples are counted by stack, see render_profile
+    """
+    def sample_forever():
+        own_id = threading.get_ident()
+        while True:
+            time.sleep(interval)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append('{}:{}'.format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                    frame = frame.f_back
+                stack = ';'.join(reversed(stack))
+                with metrics_lock:
+                    profile[stack if stack in profile or len(profile) < PROFILE_MAX_STACKS else 'other'] += 1
+
+    if interval > 0:
+        threading.Thread(target=sample_forever, name='profiler', daemon=True).start()
+
+
+def render_profile():
+    """
+    This function writes the profile as collapsed stacks (one stack & its number of samples per line),
+    the input of flame graph tools
+    :return str:
+    """
+    with metrics_lock:
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in profile.most_common())
@@ -0,0 +1,81 @@
+import os
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+import flask
+from metrics import increment
+
+try:
+    import brotli
+except ImportError:
+    # Without brotli, responses are only precompressed with gzip
+    brotli = None
+
+# Number of payloads (eg. of the time series API) every worker keeps in memory
+PAYLOAD_CACHE_SIZE = int(os.environ.get('PAYLOAD_CACHE_SIZE', '256'))
+
+# Payloads by key, least recently used first
+payloads = OrderedDict()
+payloads_lock = threading.Lock()
+
+
+def encode_payload(body, mimetype, fast=False):
+    """
+    This function compresses a response body once, so it can be sent many times without
+    serializing or compressing it again. Every encoding gets its own strong ETag
+    :param fast: compress faster but less, for bodies built on request
+    :return dict:
+    """
+    etag = hashlib.sha1(body).hexdigest()[:20]
+    payload = {'mimetype': mimetype,
+               'identity': (body, etag),
+               'gzip': (gzip.compress(body, compresslevel=6 if fast else 9), etag + '-gzip')}
+    if brotli is not None:
+        payload['br'] = (brotli.compress(body, quality=5 if fast else 11), etag + '-br')
+    return payload
+
+
+def cached_payload(key, build):
+    """
+    This function finds the payload of a key, build() is only called if it is not in memory.
+    Keys should include the version of the data, so that a new version never uses payloads of an old one
+    :return dict: see encode_payload
+    """
+    with payloads_lock:
+        if key in payloads:
+            payloads.move_to_end(key)
+            increment('dashboard_payload_cache_total', result='hit')
+            return payloads[key]
+
+    payload = build()
+    increment('dashboard_payload_cache_total', result='miss')
+    with payloads_lock:
+        payloads[key] = payload
+        while len(payloads) > PAYLOAD_CACHE_SIZE:
+            payloads.popitem(last=False)
+    return payload
+
+
+def send_payload(payload, max_age=0):
+    """
+    This function sends the best encoding of a payload the client accepts,
+    or 304 Not Modified if the client already has it
+    :return flask.Response:
+    """
+    accepted = flask.request.accept_encodings
+    encoding = next((encoding for encoding in ['br', 'gzip'] if encoding in payload and accepted[encoding]),
+                    'identity')
+    body, etag = payload[encoding]
+
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        response = flask.Response(body, mimetype=payload['mimetype'])
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    # Clients keep the response but ask whether it has changed (max_age=0) before using it
+    response.headers['Cache-Control'] = 'public, max-age={}, must-revalidate'.format(max_age)
+    return response
@@ -0,0 +1,137 @@
+import os
+import time
+import pickle
+import shutil
+import contextlib
+import numpy as np
+from metrics import timed_stage
+
+try:
+    import fcntl
+except ImportError:
+    # No file locks on Windows, every worker prepares its own data
+    fcntl = None
+
+# Prepared data is written here once and read by every worker
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', '.snapshots')
+# Workers use the current snapshot instead of reading the .csv files, if they were checked less than
+# SNAPSHOT_MAX_AGE seconds ago
+SNAPSHOT_MAX_AGE = int(os.environ.get('SNAPSHOT_MAX_AGE', '600'))
+# Changes whenever the contents of the data change, snapshots of another format are not read
+SNAPSHOT_FORMAT = 6
+# Number of snapshots kept, older ones are deleted
+KEEP_SNAPSHOTS = 2
+# Arrays of the data that are written as .npy files & memory-mapped by the workers,
+# everything else in the data is small enough to be pickled
+MAPPED_ARRAYS = ['cube', 'region_cube', 'derived', 'region_derived']
+
+
+@contextlib.contextmanager
+def snapshot_lock():
+    """
+    Only one worker at a time can read the .csv files & write a snapshot, the others wait and then read it
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    with open(os.path.join(SNAPSHOT_DIR, '.lock'), 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def mark_checked():
+    """
+    This function records that the .csv files have just been checked for new data
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    with open(os.path.join(SNAPSHOT_DIR, '.checked'), 'w') as f:
+        f.write(str(time.time()))
+
+
+def checked_age():
+    """
+    This function finds how many seconds ago the .csv files were checked for new data, by any worker
+    :return float:
+    """
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, '.checked')) as f:
+            return time.time() - float(f.read())
+    except (OSError, ValueError):
+        return float('inf')
+
+
+def current_version():
+    """
+    :return str: version of the most recent snapshot, None if there is none
+    """
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, 'CURRENT')) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+@timed_stage
+def write_snapshot(data):
+    """
+    This function writes a version of the data into SNAPSHOT_DIR/<version> and makes it the current snapshot
+    """
+    path = os.path.join(SNAPSHOT_DIR, data['version'])
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    for key in MAPPED_ARRAYS:
+        np.save(os.path.join(tmp_path, key + '.npy'), data[key])
+    small = {key: value for key, value in data.items() if key not in MAPPED_ARRAYS}
+    small['snapshot_format'] = SNAPSHOT_FORMAT
+    with open(os.path.join(tmp_path, 'data.pkl'), 'wb') as f:
+        pickle.dump(small, f)
+
+    # Workers that still map an older copy of this version keep their files until they read the new one
+    if os.path.exists(path):
+        old_path = '{}.{}.old'.format(path, os.getpid())
+        os.rename(path, old_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+    current_path = os.path.join(SNAPSHOT_DIR, 'CURRENT')
+    with open(current_path + '.tmp', 'w') as f:
+        f.write(data['version'])
+    os.replace(current_path + '.tmp', current_path)
+
+    delete_old_snapshots(data['version'])
+
+
+def delete_old_snapshots(current):
+    snapshots = sorted((entry for entry in os.scandir(SNAPSHOT_DIR)
+                        if entry.is_dir() and '.' not in entry.name and entry.name != current),
+                       key=lambda entry: entry.stat().st_mtime)
+    for entry in snapshots[:len(snapshots) - KEEP_SNAPSHOTS + 1]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+@timed_stage
+def read_snapshot(version=None):
+    """
+    This function reads a snapshot, by default the current one
+    :return dict: None if there is no snapshot
+    """
+    version = version or current_version()
+    if version is None:
+        return None
+    path = os.path.join(SNAPSHOT_DIR, version)
+    if not os.path.exists(path):
+        return None
+
+    with open(os.path.join(path, 'data.pkl'), 'rb') as f:
+        data = pickle.load(f)
+    if data.pop('snapshot_format', None) != SNAPSHOT_FORMAT:
+        return None
+    # Pages of the arrays are shared by all workers, not copied into the memory of each one
+    for key in MAPPED_ARRAYS:
+        data[key] = np.load(os.path.join(path, key + '.npy'), mmap_mode='r')
+    return data
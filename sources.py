@@ -0,0 +1,158 @@
+import io
+import os
+import re
+import csv
+import json
+import hashlib
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from metrics import timed_stage
+
+# Where the .csv files are read from. By default they are downloaded from their urls,
+# DATA_DIR reads them from a local directory and DATA_MIRROR downloads them from another server.
+# In both cases the files are found by the file name at the end of their url.
+DATA_DIR = os.environ.get('DATA_DIR')
+DATA_MIRROR = os.environ.get('DATA_MIRROR')
+# Downloaded files are kept here, parsed, together with their ETag/Last-Modified headers
+CACHE_DIR = os.environ.get('DATA_CACHE_DIR', '.data_cache')
+TIMEOUT = int(os.environ.get('DATA_TIMEOUT', '60'))
+# Columns of the time series .csv files that are dates (eg. 1/22/20) and names of places
+DATE_COLUMN = re.compile(r'\d{1,2}/\d{1,2}/\d{2}$')
+PLACE_COLUMNS = ['Country/Region', 'Province/State', 'Country_Region', 'Province_State', 'Admin2']
+
+
+def source_name(url):
+    """
+    This function finds the file name at the end of a url
+    :return str:
+    """
+    return url.strip().rstrip('/').rsplit('/', 1)[-1]
+
+
+def resolve(url):
+    """
+    This function finds where a .csv should be read from, depending on DATA_DIR and DATA_MIRROR
+    :return str: local path or url
+    """
+    url = url.strip()
+    if DATA_DIR:
+        return os.path.join(DATA_DIR, source_name(url))
+    if DATA_MIRROR:
+        return DATA_MIRROR.rstrip('/') + '/' + source_name(url)
+    return url
+
+
+def date_columns(columns):
+    """
+    :return list: the columns of a time series .csv that are dates, in order
+    """
+    return [column for column in columns if DATE_COLUMN.match(column)]
+
+
+def read_csv(source):
+    """
+    This function reads a .csv from a path or bytes. Time series (a column per date) are read with compact dtypes:
+    only the names of the places, as categories, and the counts, as int32
+    :return pd.DataFrame:
+    """
+    def buffer():
+        return io.BytesIO(source) if isinstance(source, bytes) else source
+
+    # Only the first line is read for the header, pandas would parse a whole chunk of the file
+    if isinstance(source, bytes):
+        first_line = source.split(b'\n', 1)[0].decode('utf-8-sig')
+    else:
+        with open(source, encoding='utf-8-sig', newline='') as f:
+            first_line = f.readline()
+    header = next(csv.reader([first_line]), [])
+    dates = date_columns(header)
+    if not dates:
+        return pd.read_csv(buffer(), index_col=False)
+
+    places = [column for column in header if column in PLACE_COLUMNS]
+    categories = {column: 'category' for column in places}
+    try:
+        return pd.read_csv(buffer(), index_col=False, usecols=places + dates,
+                           dtype=dict(categories, **{column: np.int32 for column in dates}))
+    except ValueError:
+        # A few counts are missing, they are read as floats first & counted as 0
+        df = pd.read_csv(buffer(), index_col=False, usecols=places + dates, dtype=categories)
+        df[dates] = df[dates].fillna(0).astype(np.int32)
+        return df
+
+
+def cache_paths(url):
+    key = hashlib.sha1(url.encode()).hexdigest()[:16] + '-' + source_name(url)
+    return os.path.join(CACHE_DIR, key + '.json'), os.path.join(CACHE_DIR, key + '.pkl')
+
+
+def write_atomic(path, write):
+    # Write to a temporary file first, so that other workers never read half a file
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def fetch(url):
+    """
+    This function downloads a .csv, unless it has not changed since the last download.
+    Unchanged files cost one conditional request and are loaded already parsed from the cache
+    :return pd.DataFrame:
+    """
+    meta_path, frame_path = cache_paths(url)
+    meta = {}
+    if os.path.exists(meta_path) and os.path.exists(frame_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    request = urllib.request.Request(url)
+    if meta.get('etag'):
+        request.add_header('If-None-Match', meta['etag'])
+    if meta.get('last_modified'):
+        request.add_header('If-Modified-Since', meta['last_modified'])
+
+    try:
+        with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+            body = response.read()
+            headers = response.headers
+    except urllib.error.HTTPError as error:
+        if error.code == 304:
+            return pd.read_pickle(frame_path)
+        raise
+
+    df = read_csv(body)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    write_atomic(frame_path, df.to_pickle)
+    meta = {'url': url, 'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}
+
+    def write_meta(path):
+        with open(path, 'w') as f:
+            json.dump(meta, f)
+
+    write_atomic(meta_path, write_meta)
+    return df
+
+
+def read_source(url):
+    """
+    This function reads one .csv from a local directory, a mirror or its url
+    :return pd.DataFrame:
+    """
+    location = resolve(url)
+    if DATA_DIR:
+        return read_csv(location)
+    return fetch(location)
+
+
+@timed_stage
+def read_sources(urls):
+    """
+    This function reads all .csv files at the same time
+    :return list: a pd.DataFrame for every url, in the same order
+    """
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        return list(executor.map(read_source, urls))
@@ -0,0 +1,36 @@
+"""
+The app reads its data when it is imported: the tests give it synthetic .csv files (see benchmarks/generate_data.py),
+their own snapshots and no refreshes in the background
+"""
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from generate_data import generate
+
+WORK_DIR = tempfile.mkdtemp(prefix='tests-')
+generate(os.path.join(WORK_DIR, 'data'), locations=30, days=40, counties=60)
+os.environ.update({'DATA_DIR': os.path.join(WORK_DIR, 'data'), 'SNAPSHOT_DIR': os.path.join(WORK_DIR, 'snapshots'),
+                   'DATA_CACHE_DIR': os.path.join(WORK_DIR, 'cache'), 'REFRESH_INTERVAL': '0', 'COUNTY_LEVEL': '1'})
+
+
+@pytest.fixture(scope='session')
+def dashboard():
+    import app
+    # Without a snapshot the data is loaded in the background
+    app.data_checked.wait()
+    return app
+
+
+@pytest.fixture(scope='session')
+def raw(dashboard):
+    """
+    :return list: the .csv files read by the app, in the order of data_urls
+    """
+    import sources
+    return sources.read_sources(dashboard.data_urls)
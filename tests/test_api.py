@@ -0,0 +1,56 @@
+import json
+import threading
+import pytest
+
+
+def get_series(dashboard, location):
+    return dashboard.server.test_client().get('/api/v1/series', query_string={'location': location,
+                                                                             'metric': 'New Confirmed'})
+
+
+def test_series_of_a_location(dashboard):
+    response = get_series(dashboard, dashboard.DEFAULT_COUNTRY)
+    assert response.status_code == 200
+    assert len(json.loads(response.data)['dates']) == len(dashboard.dataset['dates'])
+
+
+@pytest.mark.parametrize('location', ['Nowhere', 'United Kingdom / A / B / C'])
+def test_unknown_locations_are_bad_requests(dashboard, location):
+    assert get_series(dashboard, location).status_code == 400
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'br', 'identity'])
+def test_layout_is_not_sent_again_if_unchanged(dashboard, encoding):
+    client = dashboard.server.test_client()
+    response = client.get('/_dash-layout', headers={'Accept-Encoding': encoding})
+    assert response.status_code == 200
+    assert response.headers.get('Content-Encoding', 'identity') == encoding
+    etag = response.headers['ETag']
+    assert response.headers['Vary'] == 'Accept-Encoding'
+
+    response = client.get('/_dash-layout', headers={'Accept-Encoding': encoding, 'If-None-Match': etag})
+    assert response.status_code == 304 and not response.data
+    assert response.headers['ETag'] == etag
+    # Another encoding of the layout has another ETag
+    other = 'identity' if encoding != 'identity' else 'gzip'
+    assert client.get('/_dash-layout', headers={'Accept-Encoding': other, 'If-None-Match': etag}).status_code == 200
+
+
+def test_probes_once_the_data_is_shown(dashboard):
+    client = dashboard.server.test_client()
+    assert client.get('/healthz').status_code == 200
+    response = client.get('/readyz')
+    assert response.status_code == 200
+    assert json.loads(response.data)['version'] == dashboard.dataset['version']
+
+
+def test_probes_while_the_data_is_loading(dashboard, monkeypatch):
+    monkeypatch.setattr(dashboard, 'dataset', None)
+    monkeypatch.setattr(dashboard, 'data_checked', threading.Event())
+    client = dashboard.server.test_client()
+    health = client.get('/healthz')
+    assert health.status_code == 200 and json.loads(health.data)['checking']
+    ready = client.get('/readyz')
+    assert ready.status_code == 503 and json.loads(ready.data)['status'] == 'loading'
+    page = client.get('/')
+    assert page.status_code == 503 and page.headers['Retry-After'] == str(dashboard.LOAD_RETRY_INTERVAL)
@@ -0,0 +1,120 @@
+import os
+import json
+import pytest
+import pandas as pd
+import plotly.utils
+import snapshot
+import figure_cache
+
+
+def call(dashboard, output, inputs):
+    """
+    This function calls a callback through the Flask server, like the browser does
+    :return flask.Response:
+    """
+    body = {'output': output, 'outputs': None, 'state': [],
+            'inputs': [{'id': component, 'property': prop, 'value': value} for component, prop, value in inputs],
+            'changedPropIds': ['{}.{}'.format(component, prop) for component, prop, value in inputs]}
+    return dashboard.server.test_client().post('/_dash-update-component', json=body)
+
+
+def country_series(dashboard, country, province=None, county=None, metric='New'):
+    return call(dashboard, '..country-store.data...status.children..',
+                [('country', 'value', country), ('province', 'value', province), ('county', 'value', county),
+                 ('bar-metric', 'value', metric)])
+
+
+def figure_files(dashboard):
+    directory = os.path.join(snapshot.SNAPSHOT_DIR, dashboard.dataset['version'], 'figures')
+    return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+
+def test_country_series_of_a_known_country(dashboard):
+    response = country_series(dashboard, dashboard.DEFAULT_COUNTRY)
+    assert response.status_code == 200
+    series = json.loads(response.data)['response']['country-store']['data']
+    assert series['location'] == dashboard.DEFAULT_COUNTRY
+    assert len(series['values']['Deaths']) == len(dashboard.dataset['dates'])
+
+
+@pytest.mark.parametrize('country, province, county, metric', [
+    ('Nowhere', None, None, 'New'),
+    ('United Kingdom', 'Nowhere', None, 'New'),
+    ('United Kingdom', None, None, 'Unknown'),
+    (['not', 'a', 'name'], None, None, 'New')])
+def test_unknown_inputs_are_not_counted_or_cached(dashboard, country, province, county, metric):
+    views, files = dict(dashboard.country_views), figure_files(dashboard)
+    figures = list(figure_cache.figures)
+    response = country_series(dashboard, country, province, county, metric)
+    assert response.status_code == 204
+    assert dict(dashboard.country_views) == views
+    assert figure_files(dashboard) == files
+    assert list(figure_cache.figures) == figures
+
+
+def table_page(dashboard, sort_by, filter_query):
+    response = call(dashboard, '..table.data...table.page_count..',
+                    [('table', 'page_current', 0), ('table', 'page_size', 20), ('table', 'sort_by', sort_by),
+                     ('table', 'filter_query', filter_query)])
+    assert response.status_code == 200
+    return json.loads(response.data)['response']['table']['data']
+
+
+def test_table_compares_text_columns_as_text(dashboard):
+    rows = table_page(dashboard, [], '{Location} > M')
+    assert rows and all(row['Location'] > 'M' for row in rows)
+    # Numbers in the filter of a text column are compared as text too, instead of failing
+    assert all(row['Location'] > '5' for row in table_page(dashboard, [], '{Location} > 5'))
+    assert table_page(dashboard, [], '{Location} < 5') == []
+
+
+def test_table_sorted_by_an_unknown_column_keeps_the_default_order(dashboard):
+    assert table_page(dashboard, [{'column_id': 'Nowhere', 'direction': 'asc'}], '') == table_page(dashboard, [], '')
+
+
+@pytest.mark.parametrize('filter_query, locations', [
+    ('{Location} contains "Isle of Man"', ['Isle of Man']),
+    ('{Location} contains Isle of', ['Isle of Man']),
+    ('{Location} = "Greece"', ['Greece']),
+    ('{Location} eq Greece', ['Greece']),
+    ('{Deaths} >= 20', ['Isle of Man', 'Greece']),
+    ('{Deaths} ge 20 && {Location} ne "Greece"', ['Isle of Man']),
+    ('{Location} is Greece', ['Isle of Man', 'Greece', 'Gabon'])])
+def test_filter_operators_are_read_after_the_column(dashboard, filter_query, locations):
+    table_df = pd.DataFrame({'Location': ['Isle of Man', 'Greece', 'Gabon'], 'Deaths': [20, 30, 10]})
+    assert table_df['Location'][dashboard.filter_table(table_df, filter_query)].tolist() == locations
+
+
+def map_date(dashboard, column):
+    response = call(dashboard, 'Map.figure', [('map-date', 'value', column)])
+    assert response.status_code == 200
+    return json.loads(response.data)['response']['Map']['figure']
+
+
+def test_map_of_a_date_is_cached(dashboard):
+    column = len(dashboard.dataset['dates']) - 2
+    figure = map_date(dashboard, column)
+    assert figure['layout']['title']['text'] == dashboard.dataset['dates'][column].strftime('%d %B %Y')
+    assert (dashboard.map_frames['version'], 'Map', column) in figure_cache.figures
+    assert map_date(dashboard, column) == figure
+    # Unknown dates show the most recent one
+    assert map_date(dashboard, 'yesterday') == map_date(dashboard, len(dashboard.dataset['dates']) - 1)
+
+
+def find_frames(component):
+    if isinstance(component, dict):
+        if 'frames' in component:
+            return component['frames']
+        component = list(component.values())
+    if isinstance(component, list):
+        return next((frames for frames in map(find_frames, component) if frames is not None), None)
+    return None
+
+
+def test_animated_map_shows_every_map_frame_step_days(dashboard, monkeypatch):
+    monkeypatch.setattr(dashboard, 'MAP_MODE', 'animated')
+    monkeypatch.setattr(dashboard, 'MAP_FRAME_STEP', 7)
+    layout = json.loads(json.dumps(dashboard.build_layout(dashboard.dataset), cls=plotly.utils.PlotlyJSONEncoder))
+    frames = find_frames(layout)
+    assert len(frames) == len(dashboard.map_columns(dashboard.dataset))
+    assert frames[-1]['name'] == str(dashboard.dataset['dates'][-1])
@@ -0,0 +1,134 @@
+import shutil
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+DATES = ['1/22/20', '1/23/20', '1/24/20', '1/25/20', '1/26/20']
+
+
+def time_series_df():
+    """
+    A time series .csv with a location in two rows (summed up) and corrections of the totals (negative new cases)
+    """
+    return pd.DataFrame([['', 'Alpha', 1.0, 2.0, 0, 5, 9, 7, 12],
+                         ['Island', 'Alpha', 3.0, 4.0, 1, 1, 2, 2, 3],
+                         ['', 'Beta', 5.0, 6.0, 4, 4, 10, 8, 8],
+                         ['', 'Gamma', 7.0, 8.0, 0, 0, 0, 1, 3]],
+                        columns=['Province/State', 'Country/Region', 'Lat', 'Long'] + DATES)
+
+
+def old_new_cases(df, total_column, new_column):
+    """
+    The new cases per day as prepare_data found them before they were vectorized: one location at a time,
+    then every negative value set to 0 row by row
+    """
+    df = df.rename(columns={'Country/Region': 'Location'}).drop(columns=['Province/State', 'Lat', 'Long'])
+    df = df.melt(id_vars=['Location'], var_name='Date', value_name=total_column)
+    df[total_column] = df[total_column].astype(int)
+    df['Date'] = df['Date'].apply(lambda x: datetime.strptime(x, '%m/%d/%y').date())
+    df = df.groupby(['Location', 'Date'])[total_column].sum().to_frame()
+    df = df.assign(**df.index.to_frame()).reset_index(drop=True)[['Location', 'Date', total_column]]
+
+    new_df = pd.DataFrame(columns=['Location', 'Date', total_column, new_column])
+    for country in df['Location'].unique().tolist():
+        country_df = df.loc[df['Location'] == country].sort_values('Date')
+        country_df[new_column] = country_df[total_column].diff().fillna(0).astype(int)
+        new_df = pd.concat([new_df, country_df])
+    for i in range(len(new_df) - 1):
+        if new_df.iloc[i + 1, 3] < 0:
+            new_df.iloc[i + 1, 3] = 0
+    return new_df.reset_index(drop=True)
+
+
+def test_new_cases_match_the_old_loop(dashboard):
+    totals = dashboard.time_series_totals(time_series_df())[0]
+    cube = dashboard.build_cube({name: totals for name in dashboard.TIME_SERIES})
+    new_df = pd.DataFrame({'Location': np.repeat(totals.index.to_numpy(), len(totals.columns)).astype(object),
+                           'Date': np.tile(np.array(totals.columns, dtype=object), len(totals)),
+                           'Total Confirmed': cube[:, :, 0].ravel().astype(int),
+                           'New Confirmed': cube[:, :, 1].ravel().astype(int)})
+
+    expected = old_new_cases(time_series_df(), 'Total Confirmed', 'New Confirmed')
+    expected[['Total Confirmed', 'New Confirmed']] = expected[['Total Confirmed', 'New Confirmed']].astype(int)
+    pd.testing.assert_frame_equal(new_df, expected)
+    # Alpha's rows are summed up and its correction (16 -> 9) is 0 new cases, not -7
+    assert new_df.loc[new_df['Location'] == 'Alpha', 'New Confirmed'].tolist() == [0, 5, 5, 0, 6]
+
+
+def test_time_series_with_other_locations_and_dates_are_aligned(dashboard, raw):
+    recovered_df = raw[2]
+    missing = recovered_df['Country/Region'].iloc[0]
+    # The recovered cases lack a location and lag by a day
+    lagging = recovered_df[recovered_df['Country/Region'] != missing].iloc[:, :-1]
+    data = dashboard.build_data(raw[0], raw[1], lagging, *raw[3:])
+    full = dashboard.build_data(*raw)
+
+    recovered = [dashboard.METRICS.index('Total Recovered'), dashboard.METRICS.index('New Recovered')]
+    others = [column for column in range(len(dashboard.METRICS)) if column not in recovered]
+    row = data['location_index'][missing]
+    np.testing.assert_array_equal(data['cube'][:, :, others], full['cube'][:, :, others])
+    assert not data['cube'][row, :, recovered].any()
+    assert not data['cube'][:, -1, recovered[0]].any()
+    rows = [data['location_index'][location] for location in data['shown_countries'] if location != missing]
+    np.testing.assert_array_equal(data['cube'][rows, :-1][:, :, recovered], full['cube'][rows, :-1][:, :, recovered])
+
+
+def drop_last_day(df):
+    return df.iloc[:, :-1]
+
+
+def assert_data_equal(data, expected):
+    assert data['dates'] == expected['dates']
+    assert data['shown_countries'] == expected['shown_countries']
+    assert data['regions'] == expected['regions']
+    for key in ['cube', 'region_cube']:
+        np.testing.assert_array_equal(data[key], expected[key])
+    for key in ['derived', 'region_derived']:
+        np.testing.assert_allclose(data[key], expected[key], rtol=1e-5)
+    pd.testing.assert_frame_equal(data['sum_data_daily_df'], expected['sum_data_daily_df'])
+
+
+def test_update_with_a_new_day_matches_a_full_build(dashboard, raw):
+    # The county .csv files (if any) are after cases_country & the continents
+    previous = dashboard.build_data(*[drop_last_day(df) for df in raw[:3]], *raw[3:5],
+                                    *[drop_last_day(df) for df in raw[5:]])
+    assert_data_equal(dashboard.update_data(previous, *raw), dashboard.build_data(*raw))
+
+
+def test_update_with_new_locations_in_one_time_series_is_a_full_build(dashboard, raw):
+    deaths_df = raw[1]
+    missing = deaths_df['Country/Region'].iloc[0]
+    previous = dashboard.build_data(raw[0], deaths_df[deaths_df['Country/Region'] != missing], *raw[2:])
+    # Only the deaths gained a location: no new day, but its deaths are not 0 anymore
+    data = dashboard.update_data(previous, *raw)
+    assert_data_equal(data, dashboard.build_data(*raw))
+    assert data['cube'][data['location_index'][missing], -1, dashboard.METRICS.index('Total Deaths')] > 0
+
+
+def test_refresh_publishes_a_full_build_without_a_new_day(dashboard, tmp_path, monkeypatch):
+    import sources
+    import snapshot
+    data_dir = tmp_path / 'data'
+    shutil.copytree(sources.DATA_DIR, data_dir)
+    monkeypatch.setattr(sources, 'DATA_DIR', str(data_dir))
+    # Every refresh reads the .csv files, instead of the snapshot another refresh just wrote
+    monkeypatch.setattr(dashboard, 'SNAPSHOT_MAX_AGE', 0)
+    deaths_path = data_dir / 'time_series_covid19_deaths_global.csv'
+    deaths_df = pd.read_csv(deaths_path)
+    deaths = dashboard.METRICS.index('Total Deaths')
+
+    def shown_deaths():
+        data = dashboard.dataset
+        return data['cube'][data['location_index'][dashboard.DEFAULT_COUNTRY], -1, deaths]
+
+    deaths_df[deaths_df['Country/Region'] != dashboard.DEFAULT_COUNTRY].to_csv(deaths_path, index=False)
+    dashboard.refresh_data()
+    assert shown_deaths() == 0
+    version = dashboard.dataset['version']
+
+    # The deaths of the location are back: same dates & update time, but other data
+    deaths_df.to_csv(deaths_path, index=False)
+    assert dashboard.refresh_data()
+    assert dashboard.dataset['version'] != version
+    assert shown_deaths() > 0
+    assert snapshot.read_snapshot()['version'] == dashboard.dataset['version']
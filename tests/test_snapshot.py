@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+import snapshot
+
+
+def test_snapshot_is_read_as_written(dashboard, monkeypatch, tmp_path):
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_DIR', str(tmp_path))
+    assert snapshot.read_snapshot() is None
+    snapshot.write_snapshot(dashboard.dataset)
+    assert snapshot.current_version() == dashboard.dataset['version']
+
+    data = snapshot.read_snapshot()
+    assert set(data) == set(dashboard.dataset)
+    assert data['dates'] == dashboard.dataset['dates']
+    for key in snapshot.MAPPED_ARRAYS:
+        # Arrays are mapped read-only from the file, not copied
+        assert isinstance(data[key], np.memmap) and data[key].mode == 'r'
+        np.testing.assert_array_equal(data[key], dashboard.dataset[key])
+        with pytest.raises(ValueError):
+            data[key][0] = 0
+
+
+def test_snapshots_of_another_format_are_not_read(dashboard, monkeypatch, tmp_path):
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_DIR', str(tmp_path))
+    snapshot.write_snapshot(dashboard.dataset)
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_FORMAT', snapshot.SNAPSHOT_FORMAT + 1)
+    assert snapshot.read_snapshot() is None
@@ -0,0 +1,32 @@
+import io
+import urllib.error
+import urllib.request
+import sources
+
+URL = 'https://example.org/time_series_covid19_confirmed_global.csv'
+CSV = b'Province/State,Country/Region,Lat,Long,1/22/20,1/23/20\n,Greece,39,22,0,1\n'
+
+
+class Response(io.BytesIO):
+    headers = {'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jun 2020 00:00:00 GMT'}
+
+
+def test_unchanged_files_are_read_from_the_cache(monkeypatch, tmp_path):
+    requests = []
+
+    def urlopen(request, timeout):
+        requests.append(request)
+        if len(requests) == 1:
+            return Response(CSV)
+        raise urllib.error.HTTPError(request.full_url, 304, 'Not Modified', {}, None)
+
+    monkeypatch.setattr(sources, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(urllib.request, 'urlopen', urlopen)
+    downloaded = sources.fetch(URL)
+    cached = sources.fetch(URL)
+
+    assert not requests[0].has_header('If-none-match')
+    assert requests[1].get_header('If-none-match') == '"v1"'
+    assert requests[1].get_header('If-modified-since') == 'Mon, 01 Jun 2020 00:00:00 GMT'
+    assert cached.equals(downloaded)
+    assert downloaded.iloc[0, -1] == 1